@@ -3,7 +3,7 @@
     Client program for GeckoLib. Publishes most relevant data
     on a configured broker.
 
-    version 0.6.0
+    version 0.7.0
 """
 
 # import python modules
@@ -14,23 +14,46 @@ import logging
 import logging.handlers
 
 import asyncio
+import json
 import signal
 
 # import custom modules
 from mqtt import Mqtt
 from paho.mqtt.client import MQTT_ERR_QUEUE_SIZE
 
-from geckolib import GeckoConstants, GeckoSpaState
-
 # own module
 from mySpa import MySpa
+from publisher import Publisher
+from journal import configured_journal
+from session import run_session, SESSION_OK
+from worker import SpaWorker
+from localapi import LocalApi
+from sdnotify import Notifier, Watchdog
+import encoding
+
+from geckolib import GeckoSpaState
 
 # import config
-import config
+from settings import config, apply_log_levels
 import const
 
 # keep running until terminated
 stop_service = False
+# reload the configuration, set by SIGHUP or the reload command
+reload_config = False
+
+# configuration values applied on reload, others are read on each use
+LOG_SETTINGS = {"DEBUG_LEVEL", "GECKOLIB_DEBUG_LEVEL"}
+PUBLISH_SETTINGS = {"PAYLOAD_ENCODING", "TOPIC_ENCODINGS",
+                    "PUBLISH_POLICIES", "PUBLISH_POLICY_DEFAULT"}
+BROKER_SETTINGS = {"BROKER_ADDRESS", "BROKER_PORT",
+                   "BROKER_USERNAME", "BROKER_PASSWORD", "BROKER_ID"}
+# configuration values only applied by a restart
+RESTART_SETTINGS = {"SPA_NAME", "SPA_IDENTIFIER", "SPA_IP_ADDRESS", "CLIENT_ID",
+                    "LOGFILE", "BACKUP_COUNT", "PROCESS_ISOLATION", "WORKER_TIMEOUT",
+                    "HTTP_ADDRESS", "HTTP_PORT", "HTTP_CLIENT_BUFFER",
+                    "JOURNAL_FILE", "JOURNAL_MAX_BYTES", "JOURNAL_BACKUP_COUNT",
+                    "WATCHDOG_MAX_LAG", "WATCHDOG_SPA_TIMEOUT", "WATCHDOG_BROKER_TIMEOUT"}
 
 # handler for signals
 
@@ -41,6 +64,12 @@ def handler_stop_signals(signum, frame):
     stop_service = True
 
 
+def handler_reload_signal(signum, frame):
+    global reload_config, logger
+    logger.debug(f'Reload requested: {signum}')
+    reload_config = True
+
+
 # prepare logger
 def prepare_logger():
     global logger
@@ -85,6 +114,112 @@ def prepare_logger():
 ##########
 
 
+def is_reload_command(payload: bytes) -> bool:
+    '''
+    Check if the control message is {"reload":"config"}
+    '''
+    try:
+        msg = encoding.decode(
+            payload, encoding.configured_encoding(const.TOPIC_CONTROL))
+    except Exception:
+        return False
+    return isinstance(msg, dict) and msg.get("reload") == "config"
+
+
+async def apply_config(mqtt: Mqtt, publisher: Publisher, control, controls, worker: SpaWorker) -> None:
+    '''
+    Reload the configuration and apply the changed values without
+    interrupting the spa session
+    '''
+    changed = config.reload()
+    if changed is None:
+        return
+    if not changed:
+        logger.info("Configuration unchanged")
+        return
+    logger.info(f"Configuration changed: {', '.join(sorted(changed))}")
+
+    if changed & LOG_SETTINGS:
+        apply_log_levels()
+    if worker is not None:
+        # the worker reads its own configuration
+        worker.reload()
+
+    if changed & BROKER_SETTINGS:
+        await mqtt.reconnect(config.BROKER_ADDRESS, config.BROKER_PORT,
+                             getattr(config, "BROKER_USERNAME", None),
+                             getattr(config, "BROKER_PASSWORD", None))
+
+    if "TOPIC" in changed:
+        mqtt.unsubscribe(const.TOPIC_CONTROL)
+        const.set_prefix(config.TOPIC)
+        await mqtt.subscribe_and_message_callback_async(const.TOPIC_CONTROL, controls)
+        # publish all values again on the new topics
+        publisher.clear()
+        await control(b'{"refresh":"all"}', const.TOPIC_CONTROL)
+    elif changed & PUBLISH_SETTINGS:
+        publisher.reconfigure()
+
+    if changed & (PUBLISH_SETTINGS | {"TOPIC"}):
+        mqtt.publish(const.TOPIC_SCHEMA, json.dumps(
+            encoding.schema()), qos=1, retain=True)
+
+    restart = changed & RESTART_SETTINGS
+    if restart:
+        logger.warning(
+            f"Restart needed to apply {', '.join(sorted(restart))}")
+
+
+async def maintenance(mqtt: Mqtt, publisher: Publisher, reload) -> None:
+    '''
+    Publish delayed values and heartbeats, report the publish rates and
+    reload the configuration if requested
+    '''
+    global reload_config
+    report_counter = 0
+
+    while True:
+        if reload_config:
+            reload_config = False
+            try:
+                await reload()
+            except Exception as ex:
+                logger.error(f"Can't apply the configuration: {ex!r}")
+
+        # read on each loop, the configuration can be reloaded
+        report_int = getattr(config, "POLICY_REPORT_INTERVAL", 300)
+
+        # delayed publishes and heartbeats of the publish policies
+        publisher.tick()
+
+        # report the effective publish rates
+        report_counter += 1
+        if report_int and report_counter >= report_int:
+            report_counter = 0
+            stats = publisher.report()
+            for topic, values in stats.items():
+                logger.info(f"Publish rate {topic}: {values}")
+            mqtt.publish(const.TOPIC_STATS, json.dumps(stats))
+
+        await asyncio.sleep(1)
+
+
+def start_watchdog(notifier: Notifier, mqtt: Mqtt, publisher: Publisher, ready, spa_alive):
+    '''
+    Notify systemd when ready and keep its watchdog alive while healthy
+    '''
+    if not notifier.enabled:
+        return None
+    watchdog = Watchdog(notifier,
+                        # facade is ready and the first values are published
+                        lambda: ready() and bool(publisher.snapshot()),
+                        spa_alive, mqtt.isConnected,
+                        getattr(config, "WATCHDOG_MAX_LAG", 5),
+                        getattr(config, "WATCHDOG_SPA_TIMEOUT", 300),
+                        getattr(config, "WATCHDOG_BROKER_TIMEOUT", 120))
+    return asyncio.create_task(watchdog.run())
+
+
 async def main() -> None:
 
     # force decimal separator to point
@@ -95,75 +230,92 @@ async def main() -> None:
     logger.info("Connecting to MQTT...")
     mqtt = Mqtt(config.BROKER_ADDRESS, config.BROKER_PORT)
 
-    result = await mqtt.connect_mqtt(config.BROKER_USERNAME, config.BROKER_PASSWORD)
+    result = await mqtt.connect_mqtt(getattr(config, "BROKER_USERNAME", None),
+                                     getattr(config, "BROKER_PASSWORD", None))
     if result != 0:
         logger.error("Stopping - Can't connect to broker")
         exit(1)
 
-    # get IP of the SPA if set
-    ip = 'DHCP'
-    try:
-        ip = config.SPA_IP_ADDRESS
-    finally:
-        if ip == "DHCP":
-            ip = None
-
-    logger.info("Connecting to SPA...")
-    async with MySpa(config.CLIENT_ID, spa_address=ip, spa_identifier=config.SPA_IDENTIFIER, spa_name=config.SPA_NAME) as spaman:
-
-        await asyncio.sleep(GeckoConstants.ASYNCIO_SLEEP_TIMEOUT_FOR_YIELD)
-
-        # Add the value change callback to publish on mqtt
-        spaman.onValueChange(mqtt.publish_state)
-
-        # Now wait for the facade to be ready
-        is_facade_ready = await spaman.wait_for_facade()
-        if not is_facade_ready:
-            logger.error(
-                "Stopping - Can't connect to facade. Please check settings.")
-            mqtt.close()
-            exit(1)
-
-        # subscribe and add callbacks
-        await mqtt.subscribe_and_message_callback_async(
-            const.TOPIC_CONTROL, spaman.controls)
-
-        # get the facade
-        facade = spaman.facade
-
-        # set initial values
-        try:
-            broker_int = config.BROKER_INTERVAL
-        except:
-            broker_int = 10
-        refresh_counter = 0
-        reconnect_counter = 0
-
-        # Start loop until break signal received
-        while not stop_service:
-
-            refresh_counter += 1
-            # check each 10 seconds if mySpa is still connected
-            if (refresh_counter > broker_int):
-
-                refresh_counter = 1
-                if spaman.spa_state is not GeckoSpaState.CONNECTED:
-                    logger.warning("SPA is not connected. Trying to reconnect...")
-                    reconnect_counter += 1
-                    await spaman.async_connect(spa_address=ip, spa_identifier=config.SPA_IDENTIFIER)
-                    if (reconnect_counter > 5):
-                        logger.error(
-                            "Can't reconnect after 5 attempts. Quitting now...")
-                        mqtt.close()
-                        exit(2)
-                else:
-                    reconnect_counter = 0
-
-            await asyncio.sleep(1)
-
-        # final cleanup
-        await facade.disconnect()
-        mqtt.close()
+    # the values of the spa are published on mqtt
+    publisher = Publisher(mqtt.publish_state)
+
+    # publish the schema of the payloads for the consumers
+    mqtt.publish(const.TOPIC_SCHEMA, json.dumps(
+        encoding.schema()), qos=1, retain=True)
+
+    # the spa session, set once started
+    spa = {"spaman": None, "worker": None, "control": None}
+
+    async def control(payload: bytes, topic: str) -> int:
+        # the reload command is executed by the client, all others by the spa
+        global reload_config
+        if is_reload_command(payload):
+            reload_config = True
+            return const.CONTROL_OK
+        if spa["control"] is None:
+            logger.warning("Spa is not ready, control message dropped")
+            return const.CONTROL_NOT_READY
+        return await spa["control"](payload, topic)
+
+    async def controls(client, userdata, message) -> None:
+        await control(message.payload, str(message.topic))
+
+    # subscribe and add callbacks
+    await mqtt.subscribe_and_message_callback_async(const.TOPIC_CONTROL, controls)
+
+    maintenance_task = asyncio.create_task(maintenance(
+        mqtt, publisher, lambda: apply_config(mqtt, publisher, control, controls, spa["worker"])))
+
+    # systemd notifications, only if started by systemd
+    notifier = Notifier()
+
+    # local HTTP API if configured
+    api = None
+    if getattr(config, "HTTP_PORT", None):
+        api = LocalApi(publisher, getattr(config, "HTTP_ADDRESS", "127.0.0.1"),
+                       config.HTTP_PORT, getattr(config, "HTTP_CLIENT_BUFFER", 100))
+        api.setControl(control)
+        await api.start()
+
+    if getattr(config, "PROCESS_ISOLATION", False):
+        # spa session in a separate process, restarted if needed
+        logger.info("Starting SPA worker process...")
+        worker = SpaWorker(publisher.publish, getattr(config, "WORKER_TIMEOUT", 30))
+        spa["worker"] = worker
+        spa["control"] = worker.control
+
+        watchdog_task = start_watchdog(notifier, mqtt, publisher,
+                                       lambda: worker.facade_ready, worker.isConnected)
+
+        await worker.run(lambda: stop_service)
+        result = SESSION_OK
+
+    else:
+        # record change events and control messages if configured
+        journal = configured_journal()
+
+        async def on_ready(spaman: MySpa) -> None:
+            spa["spaman"] = spaman
+            spa["control"] = spaman.control
+
+        watchdog_task = start_watchdog(
+            notifier, mqtt, publisher, lambda: spa["spaman"] is not None,
+            lambda: spa["spaman"] is not None and spa["spaman"].spa_state is GeckoSpaState.CONNECTED)
+
+        result = await run_session(publisher.publish, on_ready, lambda: stop_service, journal)
+        if journal is not None:
+            journal.close()
+
+    # final cleanup
+    notifier.stopping()
+    if watchdog_task is not None:
+        watchdog_task.cancel()
+    maintenance_task.cancel()
+    if api is not None:
+        await api.close()
+    mqtt.close()
+    if result != SESSION_OK:
+        exit(result)
 
 
 #########
@@ -182,5 +334,6 @@ if __name__ == "__main__":
     # add signal listeners
     signal.signal(signal.SIGINT, handler_stop_signals)
     signal.signal(signal.SIGTERM, handler_stop_signals)
+    signal.signal(signal.SIGHUP, handler_reload_signal)
 
     asyncio.run(main())
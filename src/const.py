@@ -1,24 +1,45 @@
 '''
 Constant used internally
 '''
-from config import TOPIC
+from settings import config
 
 # GeckoClient version
-GECKO_CLIENT_VERSION = "0.6.0"
+GECKO_CLIENT_VERSION = "0.7.0"
 
 #############
 # internal constants, please do not change
 #######
 
-# topics sub-names
-TOPIC_CONTROL = TOPIC+"/control"
-TOPIC_LIGHTS = TOPIC+"/lights"
-TOPIC_REMINDERS = TOPIC+"/reminders"
-TOPIC_WATERCARE = TOPIC+"/water_care"
-TOPIC_WATERHEAT = TOPIC+"/water_heater"
-TOPIC_FILTER_STATUS = TOPIC+"/filter_status"
-TOPIC_PUMPS = TOPIC+"/pumps"
-TOPIC_BLOWERS = TOPIC+"/blowers"
-TOPIC_SMARTWINTERMODE = TOPIC+"/smart_winter_mode"
-TOPIC_OZONEMODE = TOPIC+"/ozone_mode"
+# results of control messages
+CONTROL_OK = 0
+CONTROL_NOT_READY = 1   # spa not connected yet
+CONTROL_INVALID = 2     # message can't be decoded or misses values
+CONTROL_FAILED = 3      # executing it failed
 
+
+def set_prefix(topic: str) -> None:
+    '''
+    Set the prefix (TOPIC) of all topics, again after a configuration reload.
+    '''
+    global TOPIC, TOPIC_CONTROL, TOPIC_SCHEMA, TOPIC_STATS, TOPIC_LIGHTS, \
+        TOPIC_REMINDERS, TOPIC_WATERCARE, TOPIC_WATERHEAT, TOPIC_FILTER_STATUS, \
+        TOPIC_PUMPS, TOPIC_BLOWERS, TOPIC_SMARTWINTERMODE, TOPIC_OZONEMODE
+
+    TOPIC = topic
+
+    # topics sub-names
+    TOPIC_CONTROL = TOPIC+"/control"
+    TOPIC_SCHEMA = TOPIC+"/schema"
+    TOPIC_STATS = TOPIC+"/stats"
+    TOPIC_LIGHTS = TOPIC+"/lights"
+    TOPIC_REMINDERS = TOPIC+"/reminders"
+    TOPIC_WATERCARE = TOPIC+"/water_care"
+    TOPIC_WATERHEAT = TOPIC+"/water_heater"
+    TOPIC_FILTER_STATUS = TOPIC+"/filter_status"
+    TOPIC_PUMPS = TOPIC+"/pumps"
+    TOPIC_BLOWERS = TOPIC+"/blowers"
+    TOPIC_SMARTWINTERMODE = TOPIC+"/smart_winter_mode"
+    TOPIC_OZONEMODE = TOPIC+"/ozone_mode"
+
+
+set_prefix(config.TOPIC)
@@ -0,0 +1,197 @@
+####
+# payload encodings for the published topics and the control topic
+
+from settings import config
+import const
+
+import json
+import logging
+import time
+
+# optional encoders, only needed if configured
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+logger = logging.getLogger(__name__)
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_CBOR = "cbor"
+
+ENCODINGS = (ENCODING_JSON, ENCODING_MSGPACK, ENCODING_CBOR)
+
+# format of the text timestamp in JSON payloads
+TIME_FORMAT = "%d.%m.%Y, %H:%M:%S"
+
+SCHEMA_VERSION = 1
+
+
+def available(encoding: str) -> bool:
+    '''
+    Check if the library needed for encoding is installed.
+    '''
+    if encoding == ENCODING_MSGPACK:
+        return msgpack is not None
+    if encoding == ENCODING_CBOR:
+        return cbor2 is not None
+    return encoding == ENCODING_JSON
+
+
+def configured_encoding(topic: str) -> str:
+    '''
+    Get the configured encoding of the topic. TOPIC_ENCODINGS overrides
+    PAYLOAD_ENCODING for single topics, JSON is the default.
+    Not installed or unknown encodings fall back to JSON.
+    '''
+    encoding = getattr(config, "PAYLOAD_ENCODING", ENCODING_JSON)
+    topic_encodings = getattr(config, "TOPIC_ENCODINGS", None) or {}
+    # sub-topic name without the prefix, e.g. "water_heater"
+    name = topic[len(const.TOPIC) + 1:]
+    encoding = topic_encodings.get(name, encoding)
+
+    if encoding not in ENCODINGS:
+        logger.error(f"Unknown encoding {encoding} for {topic}, using json")
+        return ENCODING_JSON
+    if not available(encoding):
+        logger.error(
+            f"Encoding {encoding} for {topic} is not installed, using json")
+        return ENCODING_JSON
+    return encoding
+
+
+def encode(payload: dict, encoding: str, timestamp: float = None):
+    '''
+    Encode the payload with a leading "Time" value.
+
+    JSON payloads keep the text timestamp (%d.%m.%Y, %H:%M:%S) and are returned
+    as str, binary payloads use integer epoch seconds and are returned as bytes.
+    '''
+    if timestamp is None:
+        timestamp = time.time()
+
+    if encoding == ENCODING_JSON:
+        data = {"Time": time.strftime(TIME_FORMAT, time.localtime(timestamp))}
+        data.update(payload)
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+    data = {"Time": int(timestamp)}
+    data.update(payload)
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(data)
+    return cbor2.dumps(data)
+
+
+def decode(data: bytes, encoding: str) -> dict:
+    '''
+    Decode a payload. JSON is always accepted, binary payloads are decoded
+    with encoding. Raises ValueError if the payload can't be decoded.
+    '''
+    if encoding == ENCODING_JSON or data[:1] == b'{':
+        return json.loads(data.decode("UTF-8"))
+    try:
+        if encoding == ENCODING_MSGPACK:
+            msg = msgpack.unpackb(data)
+        else:
+            msg = cbor2.loads(data)
+    except Exception as ex:
+        raise ValueError(f"Invalid {encoding} message: {ex}") from ex
+    if not isinstance(msg, dict):
+        raise ValueError(f"Invalid {encoding} message: not a map")
+    return msg
+
+
+########################
+#
+# Schema of the published payloads
+#
+###################
+
+# fields of each sub-topic, "*" stands for a name reported by the spa
+TOPIC_FIELDS = {
+    "water_care": {
+        "mode": "int",
+        "modes": "array of {text: str, value: int}",
+        "mode(txt)": "str",
+    },
+    "blowers": {"*": "str, state of the blower"},
+    "pumps": {"*": "str, mode of the pump or state of the circulation pump"},
+    "lights": {"*": "str, state of the light"},
+    "water_heater": {
+        "current_operation": "str",
+        "temperature_unit": "str",
+        "current_temperature": "float",
+        "target_temperature": "float",
+        "real_target_temperature": "float",
+    },
+    "reminders": {"*": "str, remaining days of the reminder"},
+    "filter_status": {
+        "Filter Status:Clean": "str, true|false",
+        "Filter Status:Purge": "str, true|false",
+    },
+    "smart_winter_mode": {
+        "Smart Winter Mode:Active": "str, true|false",
+        "Smart Winter Mode:Risk": "str",
+    },
+    "ozone_mode": {"Ozone Mode": "str, true|false"},
+}
+
+
+def schema() -> dict:
+    '''
+    Describe the payloads of all state topics with their configured encoding.
+    '''
+    topics = {}
+    for name, fields in TOPIC_FIELDS.items():
+        topic = const.TOPIC + "/" + name
+        topics[topic + "/state"] = {
+            "encoding": configured_encoding(topic),
+            "fields": fields,
+        }
+    return {
+        "version": SCHEMA_VERSION,
+        "time": {
+            ENCODING_JSON: "str, " + TIME_FORMAT.replace('%', ''),
+            ENCODING_MSGPACK: "int, epoch seconds",
+            ENCODING_CBOR: "int, epoch seconds",
+        },
+        "control": {"topic": const.TOPIC_CONTROL,
+                    "encoding": configured_encoding(const.TOPIC_CONTROL)},
+        "topics": topics,
+    }
+
+
+# typical payloads of each refresher, used by payload_bench.py and mqtt_test.py
+SAMPLE_PAYLOADS = {
+    "water_care": {
+        "mode": 1,
+        "modes": [{"text": text, "value": index} for index, text in enumerate(
+            ["Away From Home", "Standard", "Energy Saving",
+             "Super Energy Saving", "Weekender"])],
+        "mode(txt)": "Standard",
+    },
+    "blowers": {"Blower": "OFF"},
+    "pumps": {"Pump 1": "OFF", "Pump 2": "HI", "Circulation Pump": "ON"},
+    "lights": {"Lights": "OFF"},
+    "water_heater": {
+        "current_operation": "Heating",
+        "temperature_unit": "°C",
+        "current_temperature": 36.5,
+        "target_temperature": 37.0,
+        "real_target_temperature": 37.0,
+    },
+    "reminders": {"Rinse Filter": "12", "Clean Filter": "26",
+                  "Change Water": "74", "Check Spa": "5"},
+    "filter_status": {"Filter Status:Clean": "false",
+                      "Filter Status:Purge": "false"},
+    "smart_winter_mode": {"Smart Winter Mode:Active": "false",
+                          "Smart Winter Mode:Risk": "0"},
+    "ozone_mode": {"Ozone Mode": "true"},
+}
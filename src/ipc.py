@@ -0,0 +1,41 @@
+####
+# framing of the messages between the client and the worker process
+#
+# A frame is the length of the body (u32), the kind (u8) and the body,
+# a list of values encoded like the journal records.
+
+import asyncio
+import struct
+
+from typing import List, Optional, Tuple
+
+from journal import encode_values, decode_values
+
+# worker -> client
+FRAME_PUBLISH = 1    # topic, payload, force of a refresher
+FRAME_STATUS = 2     # spa state, facade ready; sent every second as heartbeat
+FRAME_RESULT = 6     # id, CONTROL_* result of a control message
+# client -> worker
+FRAME_CONTROL = 3    # id, topic, control message
+FRAME_STOP = 4       # no values
+FRAME_RELOAD = 5     # no values, reload the configuration
+
+FRAME_HEADER = struct.Struct("<IB")
+
+
+def encode_frame(kind: int, *values) -> bytes:
+    body = encode_values(values)
+    return FRAME_HEADER.pack(len(body), kind) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Tuple[int, List]]:
+    '''
+    Read the next frame as (kind, values), None if the pipe is closed.
+    '''
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, kind = FRAME_HEADER.unpack(header)
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return kind, decode_values(body)
@@ -0,0 +1,279 @@
+####
+# journal of change events and control messages in a compact binary format
+#
+# A journal file starts with MAGIC, followed by records of
+#   kind (u8), monotonic timestamp (f64), length of body (u32), body
+# The body is a list of values encoded with encode_values.
+
+from settings import config
+
+import logging
+import os
+import struct
+import time
+
+from typing import Iterator, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GCJ1"
+
+# record kinds
+RECORD_CHANGE = 1   # sender type, tag, old value, new value
+RECORD_CONTROL = 2  # topic, payload
+RECORD_STATE = 3    # topic, collected payload of a refresher, force
+
+RECORD_HEADER = struct.Struct("<BdI")
+
+# value tags
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_BYTES = 6
+_LIST = 7
+_DICT = 8
+
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_LENGTH = struct.Struct("<I")
+
+
+########################
+#
+# Value codec
+#
+###################
+
+def _encode_value(value, out: bytearray) -> None:
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int) and -2**63 <= value < 2**63:
+        out.append(_INT)
+        out += _INT64.pack(value)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(_BYTES)
+        out += _LENGTH.pack(len(value))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        out += _LENGTH.pack(len(value))
+        for item in value:
+            _encode_value(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        out += _LENGTH.pack(len(value))
+        for key, item in value.items():
+            _encode_value(key, out)
+            _encode_value(item, out)
+    else:
+        # strings and everything else as text, e.g. enums of geckolib
+        data = str(value).encode("UTF-8")
+        out.append(_STR)
+        out += _LENGTH.pack(len(data))
+        out += data
+
+
+def _decode_value(data: bytes, pos: int):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        return _INT64.unpack_from(data, pos)[0], pos + _INT64.size
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    length = _LENGTH.unpack_from(data, pos)[0]
+    pos += _LENGTH.size
+    if tag == _STR:
+        return data[pos:pos + length].decode("UTF-8"), pos + length
+    if tag == _BYTES:
+        return bytes(data[pos:pos + length]), pos + length
+    if tag == _LIST:
+        items = []
+        for _ in range(length):
+            item, pos = _decode_value(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == _DICT:
+        items = {}
+        for _ in range(length):
+            key, pos = _decode_value(data, pos)
+            items[key], pos = _decode_value(data, pos)
+        return items, pos
+    raise ValueError(f"Unknown value tag {tag} at {pos - 1}")
+
+
+def encode_values(values) -> bytes:
+    '''
+    Encode a list of values (None, bool, int, float, str, bytes, list, dict).
+    Other types are stored as their string representation.
+    '''
+    out = bytearray()
+    _encode_value(list(values), out)
+    return bytes(out)
+
+
+def decode_values(data: bytes) -> List:
+    '''
+    Decode a list of values encoded with encode_values.
+    '''
+    values, _ = _decode_value(data, 0)
+    return values
+
+
+########################
+#
+# Journal writer
+#
+###################
+
+class Journal:
+    """
+    Return a journal.
+
+    Records are appended to a buffered file, which is rotated like the log
+    file once it grows beyond max_bytes. Buffered records are written on flush,
+    close or when the buffer is full. If the file can't be written, the error
+    is logged and the journal is turned off.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 1000000, backup_count: int = 5, buffer_size: int = 65536):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self._file = None
+        try:
+            self._open()
+        except OSError as ex:
+            self._disable(ex)
+
+    def _disable(self, ex: OSError) -> None:
+        logger.error(f"Can't write journal {self.filename}, recording stopped: {ex}")
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                # buffered records are lost
+                pass
+            self._file = None
+
+    def _open(self) -> None:
+        self._file = open(self.filename, "ab", buffering=self.buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.filename}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.filename}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.filename, self.filename + ".1")
+        else:
+            os.remove(self.filename)
+        self._open()
+
+    def record(self, kind: int, *values) -> None:
+        '''
+        Append a record with the current monotonic time.
+        '''
+        if self._file is None:
+            return
+        body = encode_values(values)
+        try:
+            self._file.write(RECORD_HEADER.pack(kind, time.monotonic(), len(body)))
+            self._file.write(body)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as ex:
+            # e.g. disk full, not to be raised in the change callbacks of geckolib
+            self._disable(ex)
+
+    def record_change(self, sender_type: str, tag: str, old_value, new_value) -> None:
+        self.record(RECORD_CHANGE, sender_type, tag, old_value, new_value)
+
+    def record_control(self, topic: str, payload: bytes) -> None:
+        self.record(RECORD_CONTROL, topic, payload)
+
+    def record_state(self, topic: str, payload: dict, force: bool = False) -> None:
+        self.record(RECORD_STATE, topic, payload, force)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.flush()
+            except OSError as ex:
+                self._disable(ex)
+
+    def close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as ex:
+                logger.error(f"Can't write journal {self.filename}: {ex}")
+            self._file = None
+
+
+def configured_journal():
+    '''
+    Return the journal configured by JOURNAL_FILE or None.
+    '''
+    journal_file = getattr(config, "JOURNAL_FILE", None)
+    if not journal_file:
+        return None
+    logger.info(f"Recording journal in {journal_file}")
+    return Journal(journal_file,
+                   getattr(config, "JOURNAL_MAX_BYTES", 1000000),
+                   getattr(config, "JOURNAL_BACKUP_COUNT", 5))
+
+
+def read_journal(filename: str) -> Iterator[Tuple[int, float, List]]:
+    '''
+    Read all records of a journal file as (kind, timestamp, values).
+    A truncated last record, e.g. after a crash, is ignored.
+    '''
+    with open(filename, "rb") as file:
+        data = file.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{filename} is not a journal file")
+
+    pos = len(MAGIC)
+    while pos + RECORD_HEADER.size <= len(data):
+        kind, timestamp, length = RECORD_HEADER.unpack_from(data, pos)
+        pos += RECORD_HEADER.size
+        if pos + length > len(data):
+            logger.warning(f"Truncated record at the end of {filename}")
+            break
+        yield kind, timestamp, decode_values(data[pos:pos + length])
+        pos += length
+
+
+def journal_files(filename: str) -> List[str]:
+    '''
+    Return the rotated files of a journal, oldest first.
+    '''
+    files = []
+    index = 1
+    while os.path.exists(f"{filename}.{index}"):
+        files.insert(0, f"{filename}.{index}")
+        index += 1
+    if os.path.exists(filename):
+        files.append(filename)
+    return files
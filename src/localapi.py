@@ -0,0 +1,220 @@
+####
+# local HTTP server for the state of the spa and control messages
+#
+#   GET  /state    last published values of all topics as one JSON object
+#   GET  /events   published values as server-sent events
+#   POST /control  control message, same JSON as on the control topic
+
+import const
+import encoding
+
+import asyncio
+import json
+import logging
+
+from publisher import Publisher
+
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 10
+MAX_CONTROL_SIZE = 4096
+# seconds between keep-alive comments of the event streams
+KEEPALIVE_INTERVAL = 15
+
+# HTTP status of the CONTROL_* results
+CONTROL_STATUS = {const.CONTROL_OK: 202, const.CONTROL_NOT_READY: 503,
+                  const.CONTROL_INVALID: 400, const.CONTROL_FAILED: 500}
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           415: "Unsupported Media Type", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+def _event(topic: str, payload: dict, timestamp: float) -> bytes:
+    data = encoding.encode(payload, encoding.ENCODING_JSON, timestamp)
+    return f"event: state\ndata: {{\"topic\":{json.dumps(topic)},\"payload\":{data}}}\n\n".encode("UTF-8")
+
+
+class LocalApi:
+    """
+    Return a local API server.
+
+    The state is taken from the publisher, so the server sees the same
+    values as the broker. Each event stream has a queue of buffer_size events,
+    if a client is too slow the oldest events are dropped instead of
+    delaying the publishing.
+    """
+
+    def __init__(self, publisher: Publisher, address: str = "127.0.0.1", port: int = 8080, buffer_size: int = 100):
+        self._publisher = publisher
+        self.address = address
+        self.port = port
+        self.buffer_size = buffer_size
+        self._server = None
+        self._control = None
+        # queue and number of dropped events per event stream
+        self._clients = {}
+        self._streams = set()
+        self.dropped = 0
+
+        publisher.addListener(self._on_publish)
+
+    def setControl(self, control) -> None:
+        '''
+        Set the coroutine control(payload, topic) executing control messages
+        and returning one of the CONTROL_* results.
+        '''
+        self._control = control
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle, self.address, self.port)
+        logger.info(f"Local API listening on {self.address}:{self.port}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # event streams don't end by themselves
+            for task in list(self._streams):
+                task.cancel()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _on_publish(self, topic: str, payload: dict, timestamp: float) -> None:
+        if not self._clients:
+            return
+        event = _event(topic, payload, timestamp)
+        for queue in self._clients:
+            if queue.full():
+                queue.get_nowait()
+                self._clients[queue] += 1
+                self.dropped += 1
+            queue.put_nowait(event)
+
+    ########################
+    #
+    # HTTP handling
+    #
+    ###################
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, headers = await asyncio.wait_for(
+                self._read_request(reader), REQUEST_TIMEOUT)
+            path = path.split("?")[0]
+            logger.debug(f"Local API request: {method} {path}")
+
+            if path == "/state":
+                if method != "GET":
+                    await self._respond(writer, 405)
+                else:
+                    await self._respond(writer, 200, self._state())
+            elif path == "/events":
+                if method != "GET":
+                    await self._respond(writer, 405)
+                else:
+                    await self._stream(writer)
+            elif path == "/control":
+                if method != "POST":
+                    await self._respond(writer, 405)
+                else:
+                    await self._respond(writer, await self._control_request(reader, headers))
+            else:
+                await self._respond(writer, 404)
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError) as ex:
+            logger.debug(f"Local API request failed: {ex!r}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request = await reader.readline()
+        method, path, _ = request.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: str = None) -> None:
+        if body is None:
+            body = json.dumps({"status": REASONS[status]})
+        data = body.encode("UTF-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    def _state(self) -> str:
+        topics = [f"{json.dumps(topic)}:{encoding.encode(payload, encoding.ENCODING_JSON, timestamp)}"
+                  for topic, (payload, timestamp) in self._publisher.snapshot().items()]
+        return "{" + ",".join(topics) + "}"
+
+    async def _stream(self, writer: asyncio.StreamWriter) -> None:
+        queue = asyncio.Queue(self.buffer_size)
+        writer.write(
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1"))
+
+        # start with the current state, then follow the changes
+        for topic, (payload, timestamp) in self._publisher.snapshot().items():
+            writer.write(_event(topic, payload, timestamp))
+        self._clients[queue] = 0
+        self._streams.add(asyncio.current_task())
+        logger.info(f"Local API event stream opened, {len(self._clients)} open")
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = b": keep-alive\n\n"
+                writer.write(event)
+                await writer.drain()
+        except asyncio.CancelledError:
+            # server closed
+            pass
+        finally:
+            dropped = self._clients.pop(queue, 0)
+            self._streams.discard(asyncio.current_task())
+            logger.info(f"Local API event stream closed, {len(self._clients)} open")
+            if dropped:
+                logger.warning(
+                    f"Local API event stream too slow, {dropped} events dropped ({self.dropped} in total)")
+
+    async def _control_request(self, reader: asyncio.StreamReader, headers: dict) -> int:
+        # JSON only, browsers have to ask before sending it from other sites
+        if not headers.get("content-type", "").startswith("application/json"):
+            return 415
+        try:
+            length = int(headers.get("content-length", ""))
+        except ValueError:
+            return 400
+        if length > MAX_CONTROL_SIZE:
+            return 413
+        payload = await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT)
+        try:
+            if not isinstance(json.loads(payload), dict):
+                return 400
+        except ValueError:
+            return 400
+        if self._control is None:
+            return 503
+
+        try:
+            result = await self._control(payload, const.TOPIC_CONTROL)
+        except Exception as ex:
+            logger.error(f"Control message {payload!r} failed: {ex!r}")
+            return 500
+        return CONTROL_STATUS.get(result, 500)
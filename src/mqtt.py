@@ -2,7 +2,7 @@
 # deals with MQTT connection
 
 # import configuration variables
-from config import *
+from settings import config
 
 import asyncio
 
@@ -37,6 +37,8 @@ class Mqtt:
     def __init__(self, mqtt_server: str, mqtt_port: int = 1883):
         self.mqtt_server = mqtt_server
         self.mqtt_port = mqtt_port
+        # message callbacks by subscription, subscribed again on each connect
+        self._subscriptions = {}
 
     # MQTT message receiver
     async def on_message_async(self, client, userdata, message):
@@ -53,7 +55,9 @@ class Mqtt:
         if (rc == 0):
             logger.info(
                 f"MQTT successfully connected to broker {self.mqtt_server}")
-            # test subscription
+            # the session is clean, subscribe again
+            for sub in self._subscriptions:
+                self.client.subscribe(sub)
 
         else:
             logger.error(f"Connection error number {rc} occurred")
@@ -71,7 +75,7 @@ class Mqtt:
     async def connect_mqtt(self, user: str, password: str) -> int:
 
         self.client = AsyncioPahoClient(
-            client_id=BROKER_ID, clean_session=True)  # create new instance
+            client_id=config.BROKER_ID, clean_session=True)  # create new instance
 
         self.client.username_pw_set(user, password)
 
@@ -79,6 +83,8 @@ class Mqtt:
         self.client.on_subscribe = self.on_subscribe
         self.client.asyncio_listeners.add_on_message(self.on_message_async)
         self.on_disconnect = self.on_disconnect
+        for sub, callback in self._subscriptions.items():
+            self.client.asyncio_listeners.message_callback_add(sub, callback)
 
         try:
             self.client.connect_async(
@@ -100,20 +106,48 @@ class Mqtt:
         will be passed to 'callback'. Any non-matching messages will be passed to the default on_message callback.
         '''
         logger.info(f'Subscribing to {sub}')
-        await self.client.asyncio_subscribe(sub)
+        self._subscriptions[sub] = callback
         self.client.asyncio_listeners.message_callback_add(sub, callback)
+        # if not connected yet, it is subscribed once connected
+        await self.client.asyncio_subscribe(sub)
 
-    def publish(self, topic: str, msg: str, qos=0):
+    def unsubscribe(self, sub: str) -> None:
+        '''
+        Remove the subscription and the message callback of 'sub'.
+        '''
+        logger.info(f'Unsubscribing from {sub}')
+        self._subscriptions.pop(sub, None)
+        self.client.message_callback_remove(sub)
+        self.client.unsubscribe(sub)
+
+    async def reconnect(self, mqtt_server: str, mqtt_port: int, user: str, password: str) -> int:
+        '''
+        Connect to another broker or with other credentials, the subscriptions are kept.
+        '''
+        logger.info(f"MQTT reconnecting to broker {mqtt_server}")
+        self.close()
+        self.mqtt_server = mqtt_server
+        self.mqtt_port = mqtt_port
+        return await self.connect_mqtt(user, password)
+
+    def publish(self, topic: str, msg: str, qos=0, retain=False):
         '''
         Publish the msg in topic with qos.
         '''
-        self.client.publish(topic, msg, qos)
+        self.client.publish(topic, msg, qos, retain)
 
-    def publish_state(self, topic: str, msg: str, qos=0):
+    def publish_state(self, topic: str, msg, qos=0):
         '''
         Publish the state (msg) in topic + "/state" with qos.
+        msg is either a JSON string or the bytes of a binary encoding.
         '''
         self.client.publish(topic + "/state", msg, qos)
 
+    def isConnected(self) -> bool:
+        '''
+        Check if the client is connected to the broker.
+        '''
+        return self.client.is_connected()
+
     def close(self):
         self.client.disconnect()
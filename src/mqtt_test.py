@@ -1,49 +1,270 @@
 #
-# Small test script to ensure connectivity to the broker
+# Load test of the broker with the payloads published by GeckoClient
+#
+# Runs publishers and subscribers on TOPIC/mqtt_test and reports latency,
+# throughput, loss and reconnects. Without options it does a short
+# connectivity check with one publisher and one subscriber.
 #
 
 import paho.mqtt.client as paho
+import argparse
+import itertools
+import threading
 import time
 
-from config import *
-
-TEST_TOPIC = TOPIC + "/mqtt_test"
-
-# MQTT message receiver
-def on_message(client, userdata, message):
-    """
-    Messages fro top level TOPIC, not catched elsewhere
-    """
-    print ("Receiving message:")
-    print("message received " ,str(message.payload.decode("utf-8")))
-    print("message topic=",message.topic)
-    print("message qos=",message.qos)
-    print("message retain flag=",message.retain, "\n")
-
-# create new instance
-print("creating new instance")
-client = paho.Client(
-    BROKER_ID, clean_session=True)  # create new instance
-client.username_pw_set(BROKER_USERNAME, BROKER_PASSWORD)
-# define call method
-client.on_message = on_message
-
-# connecting to broker
-print("connecting to broker\n")
-client.connect(BROKER_ADDRESS, BROKER_PORT)  # connect to broker
-client.loop_start()
-
-# subscripte to test topic
-print("Subscribing to topic",TEST_TOPIC)
-client.subscribe(TEST_TOPIC)
-
-# Publish to test topic
-print("Publishing message to test topic\n")
-client.publish(TEST_TOPIC, "This is a publish test", 0)
-
-time.sleep(4) # wait
-
-# stopping and closing
-print("Stopping loop and disconneting from broker\n")
-client.loop_stop()
-client.disconnect()
+from settings import config
+
+import encoding
+
+TEST_TOPIC = config.TOPIC + "/mqtt_test"
+
+
+class Stats:
+    """Counters shared by all clients"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.sent = {}          # publisher -> number of sent messages
+        self.sent_bytes = 0
+        self.received = {}      # (subscriber, publisher) -> set of sequence numbers
+        self.received_bytes = 0
+        self.duplicates = 0
+        self.latencies = []     # seconds
+        self.disconnects = 0
+        self.reconnects = 0
+        self.reconnect_times = []  # seconds between disconnect and connect
+        self.errors = 0
+
+
+class TestClient:
+    """Paho client counting (re)connects"""
+
+    def __init__(self, name: str, stats: Stats, args) -> None:
+        self.name = name
+        self.stats = stats
+        self.args = args
+        self.connected = threading.Event()
+        self._disconnected_at = None
+
+        self.client = paho.Client(
+            f"{config.BROKER_ID}-{name}", clean_session=True)  # create new instance
+        self.client.username_pw_set(getattr(config, "BROKER_USERNAME", None),
+                                    getattr(config, "BROKER_PASSWORD", None))
+        self.client.reconnect_delay_set(min_delay=1, max_delay=4)
+        # let the queue grow with qos > 0, loss is measured by the subscribers
+        self.client.max_inflight_messages_set(args.inflight)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            print(f"{self.name}: connection refused, rc={rc}")
+            return
+        if self._disconnected_at is not None:
+            with self.stats.lock:
+                self.stats.reconnects += 1
+                self.stats.reconnect_times.append(
+                    time.monotonic() - self._disconnected_at)
+            self._disconnected_at = None
+        self.subscribe()
+        self.connected.set()
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        if rc != 0:
+            print(f"{self.name}: unexpected disconnection, rc={rc}")
+            self._disconnected_at = time.monotonic()
+            with self.stats.lock:
+                self.stats.disconnects += 1
+
+    def subscribe(self) -> None:
+        pass
+
+    def start(self) -> None:
+        self.client.connect_async(self.args.host, self.args.port)
+        self.client.loop_start()
+
+    def stop(self) -> None:
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+class TestSubscriber(TestClient):
+
+    def __init__(self, index: int, stats: Stats, args) -> None:
+        super().__init__(f"sub{index}", stats, args)
+        self.index = index
+        self.client.on_message = self.on_message
+
+    def subscribe(self) -> None:
+        self.client.subscribe(TEST_TOPIC + "/#", self.args.qos)
+
+    def on_message(self, client, userdata, message):
+        now = time.monotonic_ns()
+        try:
+            payload = encoding.decode(message.payload, self.args.encoding)
+            publisher, seq, sent = payload["_lt"]
+        except Exception:
+            with self.stats.lock:
+                self.stats.errors += 1
+            return
+        with self.stats.lock:
+            received = self.stats.received.setdefault(
+                (self.index, publisher), set())
+            if seq in received:
+                self.stats.duplicates += 1
+            received.add(seq)
+            self.stats.received_bytes += len(message.payload)
+            self.stats.latencies.append((now - sent) / 1e9)
+
+
+class TestPublisher(TestClient):
+
+    def __init__(self, index: int, stats: Stats, args) -> None:
+        super().__init__(f"pub{index}", stats, args)
+        self.index = index
+        self.shapes = itertools.cycle(args.shape)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def payload(self, shape: str, seq: int):
+        data = dict(encoding.SAMPLE_PAYLOADS[shape])
+        data["_lt"] = [self.index, seq, time.monotonic_ns()]
+        msg = self.encode(data)
+        pad = 0
+        while self.args.size and len(msg) < self.args.size:
+            # pad to at least the requested size, the overhead depends on the encoding
+            pad += self.args.size - len(msg)
+            data["_pad"] = "x" * pad
+            msg = self.encode(data)
+        return msg
+
+    def encode(self, data: dict) -> bytes:
+        msg = encoding.encode(data, self.args.encoding)
+        if isinstance(msg, str):
+            msg = msg.encode("UTF-8")
+        return msg
+
+    def run(self) -> None:
+        interval = 1 / self.args.rate
+        next_time = time.monotonic()
+        end_time = next_time + self.args.duration
+        seq = 0
+        while next_time < end_time:
+            shape = next(self.shapes)
+            msg = self.payload(shape, seq)
+            info = self.client.publish(
+                f"{TEST_TOPIC}/{self.name}/{shape}/state", msg, self.args.qos)
+            with self.stats.lock:
+                # failed publishes are counted as lost by the subscribers
+                self.stats.sent[self.index] = seq + 1
+                self.stats.sent_bytes += len(msg)
+                if info.rc != paho.MQTT_ERR_SUCCESS:
+                    self.stats.errors += 1
+            seq += 1
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start_publishing(self) -> None:
+        self.thread.start()
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return float("nan")
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(stats: Stats, args, elapsed: float) -> None:
+    sent = sum(stats.sent.values())
+    expected = sent * args.subscribers
+    received = sum(len(seqs) for seqs in stats.received.values())
+    lost = expected - received
+    latencies = sorted(stats.latencies)
+
+    print("\nResults")
+    print(f"  publishers x subscribers : {args.publishers} x {args.subscribers}")
+    print(f"  qos / encoding / shapes  : {args.qos} / {args.encoding} / {','.join(args.shape)}")
+    print(f"  sent                     : {sent} msgs, {stats.sent_bytes} bytes "
+          f"({sent / elapsed:.1f} msgs/s)")
+    print(f"  received                 : {received} of {expected} msgs, {stats.received_bytes} bytes "
+          f"({received / elapsed:.1f} msgs/s)")
+    print(f"  lost                     : {lost} ({100 * lost / expected if expected else 0:.2f}%)")
+    print(f"  duplicates               : {stats.duplicates}")
+    print(f"  errors                   : {stats.errors}")
+    print("  latency ms               : " + ", ".join(
+        f"p{p}={percentile(latencies, p) * 1000:.2f}" for p in (50, 90, 99)) +
+        f", max={latencies[-1] * 1000 if latencies else float('nan'):.2f}")
+    print(f"  disconnects / reconnects : {stats.disconnects} / {stats.reconnects}", end="")
+    if stats.reconnect_times:
+        print(f", reconnect time max={max(stats.reconnect_times):.2f}s", end="")
+    print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test of the broker with GeckoClient payloads")
+    parser.add_argument("--host", default=config.BROKER_ADDRESS, help="broker address, e.g. localhost")
+    parser.add_argument("--port", type=int, default=config.BROKER_PORT)
+    parser.add_argument("--publishers", type=int, default=1)
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=10,
+                        help="messages per second of each publisher")
+    parser.add_argument("--duration", type=float, default=4, help="seconds of publishing")
+    parser.add_argument("--qos", type=int, choices=(0, 1, 2), default=0)
+    parser.add_argument("--size", type=int, default=0,
+                        help="minimum payload size in bytes, payloads are padded")
+    parser.add_argument("--shape", nargs="+", choices=list(encoding.SAMPLE_PAYLOADS),
+                        default=list(encoding.SAMPLE_PAYLOADS),
+                        help="payload shapes of the refreshers, published in turn")
+    parser.add_argument("--encoding", choices=encoding.ENCODINGS, default=encoding.ENCODING_JSON)
+    parser.add_argument("--inflight", type=int, default=100,
+                        help="maximum inflight messages per client with qos > 0")
+    parser.add_argument("--drain", type=float, default=2,
+                        help="seconds to wait for outstanding messages")
+    args = parser.parse_args()
+
+    if not encoding.available(args.encoding):
+        parser.error(f"{args.encoding} is not installed")
+    if args.rate <= 0:
+        parser.error("--rate must be greater than 0")
+
+    stats = Stats()
+    subscribers = [TestSubscriber(i, stats, args) for i in range(args.subscribers)]
+    publishers = [TestPublisher(i, stats, args) for i in range(args.publishers)]
+
+    # connecting to broker
+    print(f"connecting {len(subscribers)} subscribers and {len(publishers)} publishers "
+          f"to {args.host}:{args.port}")
+    for client in subscribers + publishers:
+        client.start()
+    for client in subscribers + publishers:
+        if not client.connected.wait(10):
+            print(f"{client.name}: can't connect to broker")
+            for client in subscribers + publishers:
+                client.stop()
+            exit(1)
+    # give the broker time to process the subscriptions
+    time.sleep(0.5)
+
+    print(f"publishing {args.rate} msgs/s per publisher for {args.duration}s")
+    start = time.monotonic()
+    for publisher in publishers:
+        publisher.start_publishing()
+    for publisher in publishers:
+        publisher.thread.join()
+    elapsed = time.monotonic() - start
+
+    time.sleep(args.drain)  # wait
+
+    # stopping and closing
+    for client in publishers + subscribers:
+        client.stop()
+
+    report(stats, args, elapsed)
+
+
+if __name__ == "__main__":
+    main()
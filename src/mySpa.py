@@ -1,14 +1,13 @@
 """ Sample client demonstrating async use of GeckoLib """
 # import configuration variables
-import config
+from settings import config
 import const
 
+import encoding
+
 import asyncio
-import json
 import logging
 
-from datetime import datetime
-
 from geckolib import (GeckoSpaEvent, GeckoSpaState)
 from geckolib import GeckoAsyncSpaMan
 
@@ -29,10 +28,19 @@ class MySpa(GeckoAsyncSpaMan):
         super().__init__(client_uuid, **kwargs)
 
         self._onValueChange = None
+        self._journal = None
+        # set while refreshing all values, published regardless of the publish policies
+        self._force_publish = False
 
     def onValueChange(self, callback) -> None:
         self._onValueChange = callback
 
+    def setJournal(self, journal) -> None:
+        '''
+        Record change events, control messages and refreshed values in journal.
+        '''
+        self._journal = journal
+
     async def handle_event(self, event: GeckoSpaEvent, **kwargs) -> None:
         # Uncomment this line to see events generated
         # print(f"{event}: {kwargs}")
@@ -72,15 +80,36 @@ class MySpa(GeckoAsyncSpaMan):
     ###################
 
     async def _refreshAll(self) -> None:
-        self.refreshBlower()
-        self.refreshFilters()
-        self.refreshHeater()
-        self.refreshLights()
-        self.refreshPumps()
-        self.refreshReminders()
-        self.refreshWaterCare()
-        self.refreshOzoneMode()
-        self.refreshSmartWinterMode()
+        self._force_publish = True
+        try:
+            self.refreshBlower()
+            self.refreshFilters()
+            self.refreshHeater()
+            self.refreshLights()
+            self.refreshPumps()
+            self.refreshReminders()
+            self.refreshWaterCare()
+            self.refreshOzoneMode()
+            self.refreshSmartWinterMode()
+        finally:
+            self._force_publish = False
+
+    def _refresh(self, topic: str, collect) -> None:
+        '''
+        Collect the values with collect and pass them to the value change callback
+        callback(topic, payload, force).
+        '''
+        if self._onValueChange is None:
+            logger.error("No OnValueChange callback defined")
+            return
+
+        payload = collect()
+        if payload is None:
+            return
+
+        if self._journal is not None:
+            self._journal.record_state(topic, payload, self._force_publish)
+        self._onValueChange(topic, payload, self._force_publish)
 
     ########################
     #
@@ -89,42 +118,29 @@ class MySpa(GeckoAsyncSpaMan):
     ###################
 
     def refreshWaterCare(self) -> None:
+        self._refresh(const.TOPIC_WATERCARE, self._collectWaterCare)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing water care data")
-
-            # get the values for water care module and create a nice json payload
-
-            # get care mode
-            mode = self._facade.water_care.mode
-            if mode == None:  # only to ensure a real value
-                mode = 1
-
-            # get care modes
-            modes = self._facade.water_care.modes
-            # care mode as text
-            mode_txt = modes[mode]
+    def _collectWaterCare(self) -> dict:
+        logger.debug("Refreshing water care data")
 
-            # get actual time
-            now = datetime.now()  # current date and time
+        # get the values for water care module and create the payload
 
-            mode_len = len(modes) - 1
+        # get care mode
+        mode = self._facade.water_care.mode
+        if mode == None:  # only to ensure a real value
+            mode = 1
 
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            cjson += f'"mode":{mode}, "modes":['
+        # get care modes
+        modes = self._facade.water_care.modes
 
-            for index, mode_text in enumerate(modes):
-                cjson += "{"
-                cjson += f'"text":"{mode_text}",'
-                cjson += f'"value":{index}}},'
+        payload = {
+            "mode": mode,
+            "modes": [{"text": mode_text, "value": index}
+                      for index, mode_text in enumerate(modes)],
+            "mode(txt)": modes[mode]  # care mode as text
+        }
 
-            cjson = cjson[:-1]  # remove last comma
-            cjson += f'], "mode(txt)":"{mode_txt}"'
-            cjson += '}'
-
-            self._onValueChange(const.TOPIC_WATERCARE, cjson)
+        return payload
 
     ########################
     #
@@ -133,20 +149,16 @@ class MySpa(GeckoAsyncSpaMan):
     ###################
 
     def refreshBlower(self) -> None:
+        self._refresh(const.TOPIC_BLOWERS, self._collectBlower)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing blowers data")
-            # get actual time
-            now = datetime.now()  # current date and time
+    def _collectBlower(self) -> dict:
+        logger.debug("Refreshing blowers data")
 
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '"'
-            for blower in self._facade.blowers:
-                cjson += f',"{blower.name}":"{blower.state_sensor().state}"'
-            cjson += '}'
+        payload = {}
+        for blower in self._facade.blowers:
+            payload[blower.name] = str(blower.state_sensor().state)
 
-            self._onValueChange(const.TOPIC_BLOWERS, cjson)
+        return payload
 
     ########################
     #
@@ -155,28 +167,23 @@ class MySpa(GeckoAsyncSpaMan):
     ###################
 
     def refreshPumps(self) -> None:
+        self._refresh(const.TOPIC_PUMPS, self._collectPumps)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing pumps data")
-
-            # get actual time
-            now = datetime.now()  # current date and time
+    def _collectPumps(self) -> dict:
+        logger.debug("Refreshing pumps data")
 
-            # loop over all pumps
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '"'
-            for pump in self._facade.pumps:
-                cjson += f',"{pump.name}":"{pump.mode}"'
+        # loop over all pumps
+        payload = {}
+        for pump in self._facade.pumps:
+            payload[pump.name] = str(pump.mode)
 
-            # find circulation pump
-            for sensor in self._facade.binary_sensors:
-                if sensor.key == "CIRCULATING PUMP":
-                    cjson += f',"{sensor.name}":"{sensor.state}"'
-                    break
-            cjson += '}'
+        # find circulation pump
+        for sensor in self._facade.binary_sensors:
+            if sensor.key == "CIRCULATING PUMP":
+                payload[sensor.name] = str(sensor.state)
+                break
 
-            self._onValueChange(const.TOPIC_PUMPS, cjson)
+        return payload
 
     ########################
     #
@@ -184,20 +191,16 @@ class MySpa(GeckoAsyncSpaMan):
     #
     ###################
     def refreshLights(self) -> None:
+        self._refresh(const.TOPIC_LIGHTS, self._collectLights)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing lights data")
-            # get actual time
-            now = datetime.now()  # current date and time
+    def _collectLights(self) -> dict:
+        logger.debug("Refreshing lights data")
 
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '"'
-            for light in self._facade.lights:
-                cjson += f',"{light.name}":"{light.state_sensor().state}"'
-            cjson += '}'
+        payload = {}
+        for light in self._facade.lights:
+            payload[light.name] = str(light.state_sensor().state)
 
-            self._onValueChange(const.TOPIC_LIGHTS, cjson)
+        return payload
 
     ########################
     #
@@ -205,24 +208,21 @@ class MySpa(GeckoAsyncSpaMan):
     #
     ###################
     def refreshHeater(self) -> None:
+        self._refresh(const.TOPIC_WATERHEAT, self._collectHeater)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing heater data")
-
-            # get actual time
-            now = datetime.now()  # current date and time
+    def _collectHeater(self) -> dict:
+        logger.debug("Refreshing heater data")
 
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            cjson += f'"current_operation": "{self._facade.water_heater.current_operation}",'
-            cjson += f'"temperature_unit":"{self._facade.water_heater.temperature_unit}",'
-            cjson += f'"current_temperature":{self._facade.water_heater.current_temperature},'
-            cjson += f'"target_temperature":{self._facade.water_heater.target_temperature},'
-            cjson += f'"real_target_temperature":{self._facade.water_heater.real_target_temperature}'
-            cjson += '}'
+        water_heater = self._facade.water_heater
+        payload = {
+            "current_operation": str(water_heater.current_operation),
+            "temperature_unit": str(water_heater.temperature_unit),
+            "current_temperature": water_heater.current_temperature,
+            "target_temperature": water_heater.target_temperature,
+            "real_target_temperature": water_heater.real_target_temperature
+        }
 
-            self._onValueChange(const.TOPIC_WATERHEAT, cjson)
+        return payload
 
     ########################
     #
@@ -230,37 +230,24 @@ class MySpa(GeckoAsyncSpaMan):
     #
     ###################
     def refreshReminders(self) -> None:
+        self._refresh(const.TOPIC_REMINDERS, self._collectReminders)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-            logger.debug("Refreshing reminder data")
-
-            '''
-            get's the active remainders and create a nice json payload
-            '''
-            reminders = self._facade.reminders_manager.reminders
-            if (reminders is None) or (len(reminders) == 0):
-                logger.debug('No reminders received')
-                return
-
-            reminders_len = len(reminders) - 1
+    def _collectReminders(self) -> dict:
+        logger.debug("Refreshing reminder data")
 
-            # get actual time
-            now = datetime.now()  # current date and time
+        '''
+        get's the active remainders and create the payload
+        '''
+        reminders = self._facade.reminders_manager.reminders
+        if (reminders is None) or (len(reminders) == 0):
+            logger.debug('No reminders received')
+            return
 
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            # cjson += '{'
-            i = 0
-            for reminder in reminders:
-                cjson += f'"{reminder.description}":"{reminder.days}"'
-                if (i < reminders_len):
-                    cjson += ","
-                i += 1
-            cjson += '}'
+        payload = {}
+        for reminder in reminders:
+            payload[reminder.description] = str(reminder.days)
 
-            if cjson is not None:
-                self._onValueChange(const.TOPIC_REMINDERS, cjson)
+        return payload
 
     ########################
     #
@@ -269,26 +256,22 @@ class MySpa(GeckoAsyncSpaMan):
     ###################
 
     def refreshFilters(self) -> None:
+        self._refresh(const.TOPIC_FILTER_STATUS, self._collectFilters)
 
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
-
-            logger.debug("Refreshing filter data")
-            for sensor in self._facade.binary_sensors:
-                if (sensor.name == 'Filter Status:Clean'):
-                    filerStatusClean = sensor.state
-                if (sensor.name == 'Filter Status:Purge'):
-                    filerStatusPurge = sensor.state
+    def _collectFilters(self) -> dict:
+        logger.debug("Refreshing filter data")
+        for sensor in self._facade.binary_sensors:
+            if (sensor.name == 'Filter Status:Clean'):
+                filerStatusClean = sensor.state
+            if (sensor.name == 'Filter Status:Purge'):
+                filerStatusPurge = sensor.state
 
-            # get actual time
-            now = datetime.now()  # current date and time
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            cjson += f'"Filter Status:Clean":"{str(filerStatusClean).lower()}",'
-            cjson += f'"Filter Status:Purge":"{str(filerStatusPurge).lower()}"'
-            cjson += '}'
+        payload = {
+            "Filter Status:Clean": str(filerStatusClean).lower(),
+            "Filter Status:Purge": str(filerStatusPurge).lower()
+        }
 
-            self._onValueChange(const.TOPIC_FILTER_STATUS, cjson)
+        return payload
 
     ########################
     #
@@ -296,26 +279,23 @@ class MySpa(GeckoAsyncSpaMan):
     #
     ###################
     def refreshSmartWinterMode(self) -> None:
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
+        self._refresh(const.TOPIC_SMARTWINTERMODE, self._collectSmartWinterMode)
 
-            logger.debug("Refreshing filter data")
-            for sensor in self._facade.binary_sensors:
-                if (sensor.name == 'Smart Winter Mode:Active'):
-                    swmActive = sensor.state
-            for sensor in self._facade.sensors:
-                if (sensor.name == 'Smart Winter Mode:Risk'):
-                    swmRisk = sensor.state
+    def _collectSmartWinterMode(self) -> dict:
+        logger.debug("Refreshing filter data")
+        for sensor in self._facade.binary_sensors:
+            if (sensor.name == 'Smart Winter Mode:Active'):
+                swmActive = sensor.state
+        for sensor in self._facade.sensors:
+            if (sensor.name == 'Smart Winter Mode:Risk'):
+                swmRisk = sensor.state
 
-            # get actual time
-            now = datetime.now()  # current date and time
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            cjson += f'"Smart Winter Mode:Active":"{str(swmActive).lower()}",'
-            cjson += f'"Smart Winter Mode:Risk":"{str(swmRisk).lower()}"'
-            cjson += '}'
+        payload = {
+            "Smart Winter Mode:Active": str(swmActive).lower(),
+            "Smart Winter Mode:Risk": str(swmRisk).lower()
+        }
 
-            self._onValueChange(const.TOPIC_SMARTWINTERMODE, cjson)
+        return payload
 
     ########################
     #
@@ -323,38 +303,53 @@ class MySpa(GeckoAsyncSpaMan):
     #
     ###################
     def refreshOzoneMode(self) -> None:
-        if self._onValueChange is None:
-            logger.error("No OnValueChange callback defined")
-        else:
+        self._refresh(const.TOPIC_OZONEMODE, self._collectOzoneMode)
 
-            logger.debug("Refreshing filter data")
-            for sensor in self._facade.binary_sensors:
-                if (sensor.name == 'Ozone'):
-                    ozoneMode = sensor.state
+    def _collectOzoneMode(self) -> dict:
+        logger.debug("Refreshing filter data")
+        for sensor in self._facade.binary_sensors:
+            if (sensor.name == 'Ozone'):
+                ozoneMode = sensor.state
 
-            # get actual time
-            now = datetime.now()  # current date and time
-            cjson = '{"Time":"' + now.strftime("%d.%m.%Y, %H:%M:%S") + '",'
-            cjson += f'"Ozone Mode":"{str(ozoneMode).lower()}"'
-            cjson += '}'
+        payload = {"Ozone Mode": str(ozoneMode).lower()}
 
-            self._onValueChange(const.TOPIC_OZONEMODE, cjson)
+        return payload
 
     ################
     #
     # Controls
     #
     ##############
-    async def controls(self, client, userdata, message):
+    async def control(self, payload: bytes, topic: str = None) -> int:
         '''
-        Controlling the spa
+        Decode and execute a control message, returns one of the CONTROL_* results
         '''
+        if topic is None:
+            topic = const.TOPIC_CONTROL
+        if self._journal is not None:
+            self._journal.record_control(topic, payload)
         try:
-            msg = json.loads(message.payload.decode('UTF-8'))
+            msg = encoding.decode(
+                payload, encoding.configured_encoding(const.TOPIC_CONTROL))
         except Exception as ex:
-            logger.warning(f"Invalid JSON in mqtt message: {ex.args}")
-        topic = str(message.topic)
+            logger.warning(f"Invalid control message: {ex.args}")
+            return const.CONTROL_INVALID
         logger.debug(f'msg received: topic: {topic}, payload: {msg}')
+        try:
+            await self._execute(msg)
+        except (KeyError, ValueError, TypeError) as ex:
+            # e.g. a pump without number
+            logger.warning(f"Invalid control message {msg}: {ex!r}")
+            return const.CONTROL_INVALID
+        except Exception as ex:
+            logger.error(f"Control message {msg} failed: {ex!r}")
+            return const.CONTROL_FAILED
+        return const.CONTROL_OK
+
+    async def _execute(self, msg: dict):
+        '''
+        Controlling the spa
+        '''
         if "lights" in msg and self.facade.lights[0] is not None:
             if msg["lights"] == "on":
                 logger.info("Switching lights on")
@@ -413,6 +408,27 @@ class MySpa(GeckoAsyncSpaMan):
             logger.warning(f"Wrong command received")
 
 
+# refresher for the tags of GeckoStructAccessor senders
+TAG_REFRESHERS = {
+    "UdLi": "refreshLights",
+    "CP": "refreshPumps",
+    "P1": "refreshPumps",
+    "P2": "refreshPumps",
+    "P3": "refreshPumps",
+    "SetpointG": "refreshHeater",
+    "RealSetPointG": "refreshHeater",
+    "DisplayedTempG": "refreshHeater",
+    "Heating": "refreshHeater",
+    "TempUnits": "refreshHeater",
+    "BL": "refreshBlower",
+    "SwmRisk": "refreshSmartWinterMode",
+    "SwmActive": "refreshSmartWinterMode",
+    "O3": "refreshOzoneMode",
+    "Clean": "refreshFilters",
+    "Purge": "refreshFilters",
+}
+
+
 class OnChange():
     def __init__(self, mySpa: MySpa) -> None:
         self._mySpa = mySpa
@@ -421,44 +437,43 @@ class OnChange():
         logger.debug(f"on_spa_change: >{sender}< changed from {old_value} to {new_value}")
         print(f">{sender}< changed from {old_value} to {new_value}")
 
-        # only if facade is ready
-        if not self._mySpa._can_use_facade:
-            return
-
         if isinstance(sender, GeckoReminders):
-            self._mySpa.refreshReminders()
-
+            sender_type = "GeckoReminders"
         elif isinstance(sender, GeckoWaterCare):
-            self._mySpa.refreshWaterCare()
-
+            sender_type = "GeckoWaterCare"
         elif isinstance(sender, GeckoStructAccessor):
-            if sender.tag == "UdLi":
-                self._mySpa.refreshLights()
-
-            elif sender.tag == "CP" or sender.tag == "P1" or sender.tag == "P2" or sender.tag == "P3":
-                self._mySpa.refreshPumps()
+            sender_type = "GeckoStructAccessor"
+        else:
+            sender_type = type(sender).__name__
+        tag = getattr(sender, "tag", None)
 
-            elif sender.tag == "SetpointG" or sender.tag == "RealSetPointG" or sender.tag == "DisplayedTempG" or sender.tag == "Heating":
-                self._mySpa.refreshHeater()
+        if self._mySpa._journal is not None:
+            self._mySpa._journal.record_change(sender_type, tag, old_value, new_value)
 
-            elif sender.tag == "BL":
-                self._mySpa.refreshBlower()
+        self.dispatch(sender_type, tag, old_value, new_value)
 
-            elif sender.tag == "SwmRisk" or sender.tag == "SwmActive":
-                self._mySpa.refreshSmartWinterMode()
+    def dispatch(self, sender_type: str, tag: str, old_value, new_value):
+        '''
+        Refresh the values depending on the sender of the change
+        '''
+        # only if facade is ready
+        if not self._mySpa._can_use_facade:
+            return
 
-            elif sender.tag == "O3":
-                self._mySpa.refreshOzoneMode()
+        if sender_type == "GeckoReminders":
+            self._mySpa.refreshReminders()
 
-            elif sender.tag == "Clean" or sender.tag == "Purge":
-                self._mySpa.refreshFilters()
+        elif sender_type == "GeckoWaterCare":
+            self._mySpa.refreshWaterCare()
 
-            elif sender.tag == "TempUnits":
-                self._mySpa.refreshHeater()
+        elif sender_type == "GeckoStructAccessor":
+            refresher = TAG_REFRESHERS.get(tag)
+            if refresher is not None:
+                getattr(self._mySpa, refresher)()
 
             else:
-                logger.warning(f"Not handled GeckoStructAccessor sender tag received: {sender.tag}")
-                logger.warning(f"  --> {sender} changed from {old_value} to {new_value}")
+                logger.warning(f"Not handled GeckoStructAccessor sender tag received: {tag}")
+                logger.warning(f"  --> {tag} changed from {old_value} to {new_value}")
 
         else:
-            logger.warning(f"Change not check. Sender: {sender}, sender-type: {sender.type()}")
+            logger.warning(f"Change not check. Sender-type: {sender_type}")
@@ -0,0 +1,22 @@
+#
+# Small benchmark script comparing size and encode time of the payload encodings
+#
+
+import timeit
+
+import encoding
+
+ROUNDS = 20000
+
+print(f"{'topic':<20}{'encoding':<10}{'bytes':>8}{'us/encode':>12}")
+for topic, payload in encoding.SAMPLE_PAYLOADS.items():
+    for enc in encoding.ENCODINGS:
+        if not encoding.available(enc):
+            print(f"{topic:<20}{enc:<10}{'not installed':>20}")
+            continue
+        data = encoding.encode(payload, enc)
+        if isinstance(data, str):
+            data = data.encode("UTF-8")
+        seconds = timeit.timeit(
+            lambda: encoding.encode(payload, enc), number=ROUNDS)
+        print(f"{topic:<20}{enc:<10}{len(data):>8}{seconds / ROUNDS * 1e6:>12.2f}")
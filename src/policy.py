@@ -0,0 +1,64 @@
+####
+# publish policies limiting the publish rate per topic
+
+from settings import config
+import const
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PublishPolicy:
+    """
+    Return a publish policy.
+
+    min_interval: minimum seconds between two publishes of the topic,
+                  newer values are published once the interval has passed
+    deadband:     {field: delta}, values are not published as long as these
+                  fields changed less than delta and all other fields are equal
+    heartbeat:    maximum seconds without publish, the newest received values
+                  are published afterwards, also if held back by the deadband
+    """
+
+    def __init__(self, min_interval: float = 0, deadband: dict = None, heartbeat: float = 0):
+        self.min_interval = min_interval
+        self.deadband = deadband or {}
+        self.heartbeat = heartbeat
+
+    def within_deadband(self, last: dict, payload: dict) -> bool:
+        '''
+        Check if payload is not worth publishing compared to the last published values.
+        '''
+        if not self.deadband or last is None or last.keys() != payload.keys():
+            return False
+        for field, value in payload.items():
+            delta = self.deadband.get(field)
+            if delta is not None and isinstance(value, (int, float)) \
+                    and isinstance(last[field], (int, float)):
+                if abs(value - last[field]) >= delta:
+                    return False
+            elif value != last[field]:
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return (f"PublishPolicy(min_interval={self.min_interval}, "
+                f"deadband={self.deadband}, heartbeat={self.heartbeat})")
+
+
+def configured_policy(topic: str) -> PublishPolicy:
+    '''
+    Get the publish policy of topic from PUBLISH_POLICIES, falling back to
+    PUBLISH_POLICY_DEFAULT.
+    '''
+    policies = getattr(config, "PUBLISH_POLICIES", None) or {}
+    # sub-topic name without the prefix, e.g. "water_heater"
+    name = topic[len(const.TOPIC) + 1:]
+    settings = policies.get(name, getattr(config, "PUBLISH_POLICY_DEFAULT", None) or {})
+    try:
+        return PublishPolicy(**settings)
+    except TypeError as ex:
+        logger.error(f"Invalid publish policy for {topic}: {ex}")
+        return PublishPolicy()
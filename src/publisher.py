@@ -0,0 +1,166 @@
+####
+# encodes the values collected by MySpa and publishes them
+
+import encoding
+import policy
+
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TopicState:
+    """Publish state and counters of a single topic"""
+
+    def __init__(self, topic: str) -> None:
+        self.encoding = encoding.configured_encoding(topic)
+        self.policy = policy.configured_policy(topic)
+        logger.debug(f"Using {self.encoding} and {self.policy} for {topic}")
+
+        # last published values, monotonic time and timestamp of the publish
+        self.last = None
+        self.last_time = None
+        self.last_timestamp = None
+        # newest values received, also if not published
+        self.newest = None
+        # newest values held back by min_interval
+        self.pending = None
+
+        # counters since the last report
+        self.published = 0
+        self.heartbeats = 0
+        self.delayed = 0
+        self.suppressed = 0
+
+
+class Publisher:
+    """
+    Return a publisher.
+
+    The payloads (dict) passed to publish are filtered by the publish policy
+    of the topic, encoded with the configured encoding of the topic and handed
+    over to publish_state.
+    The timestamp of the payloads is taken from clock, the publish policies
+    use monotonic. tick needs to be called regularly for delayed publishes and
+    heartbeats. Listeners get the published payloads before encoding.
+    """
+
+    def __init__(self, publish_state, clock=time.time, monotonic=time.monotonic):
+        self._publish_state = publish_state
+        self._clock = clock
+        self._monotonic = monotonic
+        # state per topic, created on first use
+        self._topics = {}
+        self._report_time = monotonic()
+        self._listeners = []
+
+    def addListener(self, callback) -> None:
+        '''
+        Call callback(topic, payload, timestamp) for each published payload.
+        '''
+        self._listeners.append(callback)
+
+    def snapshot(self) -> dict:
+        '''
+        Return the last published payload and its timestamp of all topics.
+        '''
+        return {topic: (state.last, state.last_timestamp)
+                for topic, state in self._topics.items() if state.last is not None}
+
+    def reconfigure(self) -> None:
+        '''
+        Read the encoding and publish policy of all topics again, e.g. after
+        a configuration reload. The last published values are kept.
+        '''
+        for topic, state in self._topics.items():
+            state.encoding = encoding.configured_encoding(topic)
+            state.policy = policy.configured_policy(topic)
+
+    def clear(self) -> None:
+        '''
+        Forget all topics, e.g. after the topic prefix changed.
+        '''
+        self._topics = {}
+
+    def _state(self, topic: str) -> TopicState:
+        if topic not in self._topics:
+            self._topics[topic] = TopicState(topic)
+        return self._topics[topic]
+
+    def _send(self, topic: str, state: TopicState, payload: dict, now: float) -> None:
+        timestamp = self._clock()
+        state.last = payload
+        state.last_time = now
+        state.last_timestamp = timestamp
+        state.pending = None
+        state.published += 1
+        self._publish_state(topic, encoding.encode(
+            payload, state.encoding, timestamp))
+        for listener in self._listeners:
+            listener(topic, payload, timestamp)
+
+    def publish(self, topic: str, payload: dict, force: bool = False) -> None:
+        '''
+        Encode the payload and publish it as state of topic, if the publish
+        policy of the topic allows it or force is set.
+        '''
+        state = self._state(topic)
+        now = self._monotonic()
+        state.newest = payload
+
+        if force:
+            # explicitly requested, e.g. by a refresh of all values
+            self._send(topic, state, payload, now)
+            return
+
+        if state.policy.within_deadband(state.last, payload):
+            # the published values are still good enough
+            state.pending = None
+            state.suppressed += 1
+            return
+
+        if state.policy.min_interval and state.last_time is not None \
+                and now - state.last_time < state.policy.min_interval:
+            state.pending = payload
+            state.delayed += 1
+            return
+
+        self._send(topic, state, payload, now)
+
+    def tick(self) -> None:
+        '''
+        Publish delayed values and heartbeats which are due.
+        '''
+        now = self._monotonic()
+        for topic, state in self._topics.items():
+            if state.pending is not None:
+                if now - state.last_time >= state.policy.min_interval:
+                    self._send(topic, state, state.pending, now)
+            elif state.policy.heartbeat and state.last is not None \
+                    and now - state.last_time >= state.policy.heartbeat:
+                # the newest values, they might be within the deadband
+                state.heartbeats += 1
+                self._send(topic, state, state.newest, now)
+
+    def report(self) -> dict:
+        '''
+        Return the effective publish rate per topic since the last report
+        and reset the counters.
+        '''
+        now = self._monotonic()
+        period = max(now - self._report_time, 1e-9)
+        self._report_time = now
+
+        stats = {}
+        for topic, state in self._topics.items():
+            stats[topic] = {
+                "published": state.published,
+                "heartbeats": state.heartbeats,
+                "delayed": state.delayed,
+                "suppressed": state.suppressed,
+                "per_minute": round(state.published * 60 / period, 2),
+            }
+            state.published = state.heartbeats = state.delayed = state.suppressed = 0
+        return stats
@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+"""
+    Replays a journal recorded by GeckoClient through the dispatch and
+    refresh path of MySpa without a connection to the spa.
+
+    The refreshers publish the values recorded in the journal instead of
+    reading them from the facade. Control messages are decoded, but only
+    refresh commands are executed.
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import sys
+import time
+
+from settings import config
+import journal
+
+from mqtt import Mqtt
+from mySpa import MySpa, OnChange
+from publisher import Publisher
+
+
+logger = logging.getLogger("geckoclient.replay")
+
+
+class ReplaySpa(MySpa):
+    """Spa man publishing the recorded values of a journal"""
+
+    def __init__(self) -> None:
+        super().__init__(config.CLIENT_ID)
+        # recorded states in order as [topic, payload, force, consumed]
+        self._states = []
+        # states not consumed yet per topic, oldest first
+        self._queues = {}
+        self._can_use_facade = True
+
+    def setStates(self, states: list) -> None:
+        '''
+        Set the states recorded after an event, each one is published
+        by one refresh of its topic.
+        '''
+        self._states = [[topic, payload, force, False] for topic, payload, force in states]
+        self._queues = {}
+        for state in self._states:
+            self._queues.setdefault(state[0], collections.deque()).append(state)
+
+    def takeUnconsumed(self) -> list:
+        '''
+        Return the states not published by a refresh as (topic, payload, force)
+        in recorded order and clear the states.
+        '''
+        unconsumed = [(topic, payload, force)
+                      for topic, payload, force, consumed in self._states if not consumed]
+        self.setStates([])
+        return unconsumed
+
+    def publishState(self, topic: str, payload: dict, force: bool) -> None:
+        self._onValueChange(topic, payload, force)
+
+    def _refresh(self, topic: str, collect) -> None:
+        queue = self._queues.get(topic)
+        if not queue:
+            # nothing was published live either
+            logger.debug(f"No recorded values for {topic}")
+            return
+        # published with the recorded force, e.g. of a refresh after a reconnect
+        state = queue.popleft()
+        state[3] = True
+        self._onValueChange(topic, state[1], state[2])
+
+    async def _execute(self, msg: dict):
+        if "refresh" in msg:
+            await super()._execute(msg)
+        else:
+            logger.debug(f"Skipping control message {msg}, needs the spa")
+
+
+class Clock:
+    """Monotonic time of the record being replayed"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Sink:
+    """Counts the published states and writes them to a file or the broker"""
+
+    def __init__(self, file=None, mqtt: Mqtt = None) -> None:
+        self._file = file
+        self._mqtt = mqtt
+        self.count = 0
+
+    def publish_state(self, topic: str, msg) -> None:
+        self.count += 1
+        if self._mqtt is not None:
+            self._mqtt.publish_state(topic, msg)
+        if self._file is not None:
+            if isinstance(msg, bytes):
+                msg = msg.hex()
+            self._file.write(f"{topic}/state {msg}\n")
+
+
+async def replay(files, spa: ReplaySpa, publisher: Publisher, clock: Clock, speed: float) -> int:
+    '''
+    Feed the records of the journal files into spa. speed is the factor of the
+    replay speed, 0 replays as fast as possible. Returns the number of events.
+    '''
+    on_change = OnChange(spa)
+    events = 0
+    last_timestamp = None
+    # event waiting for the refreshed values recorded after it
+    pending = None
+    states = []
+
+    async def execute():
+        # the refreshers of the event consume the states in recorded order
+        spa.setStates(states)
+        if pending is not None:
+            kind, _, values = pending
+            if kind == journal.RECORD_CHANGE:
+                on_change.dispatch(*values)
+            else:
+                await spa.control(values[1], values[0])
+        # values refreshed without a recorded event, e.g. after facade is ready
+        for topic, payload, force in spa.takeUnconsumed():
+            spa.publishState(topic, payload, force)
+
+    for filename in files:
+        for record in journal.read_journal(filename):
+            kind, timestamp, values = record
+
+            if last_timestamp is None and pending is None and not states:
+                # start the publish rate report with the first record
+                clock.now = timestamp
+                publisher.report()
+
+            if kind == journal.RECORD_STATE:
+                # journals before force was recorded
+                if len(values) < 3:
+                    values = values + [False]
+                states.append(values)
+                continue
+
+            await execute()
+            if pending is not None:
+                events += 1
+
+            if speed > 0 and last_timestamp is not None and timestamp > last_timestamp:
+                await asyncio.sleep((timestamp - last_timestamp) / speed)
+            last_timestamp = timestamp
+
+            # publish policies follow the recorded time
+            clock.now = timestamp
+            publisher.tick()
+            pending = record
+            states = []
+
+    await execute()
+    if pending is not None:
+        events += 1
+    return events
+
+
+async def main(args) -> None:
+    spa = ReplaySpa()
+
+    mqtt = None
+    if args.publish:
+        mqtt = Mqtt(config.BROKER_ADDRESS, config.BROKER_PORT)
+        if await mqtt.connect_mqtt(config.BROKER_USERNAME, config.BROKER_PASSWORD) != 0:
+            logger.error("Stopping - Can't connect to broker")
+            sys.exit(1)
+        # give the client time to connect
+        await asyncio.sleep(2)
+
+    output = None
+    if args.output:
+        output = open(args.output, "w")
+    elif not args.quiet and mqtt is None:
+        output = sys.stdout
+    sink = Sink(output, mqtt)
+
+    # a fixed clock keeps the output of two replays comparable
+    wall_clock = time.time if args.wall_clock else (lambda: 0.0)
+    monotonic = Clock()
+    publisher = Publisher(sink.publish_state, wall_clock, monotonic)
+    spa.onValueChange(publisher.publish)
+
+    files = []
+    for filename in args.journal:
+        files += journal.journal_files(filename)
+
+    start = time.perf_counter()
+    events = await replay(files, spa, publisher, monotonic, args.speed)
+    elapsed = time.perf_counter() - start
+
+    if mqtt is not None:
+        await asyncio.sleep(1)
+        mqtt.close()
+    if output is not None and output is not sys.stdout:
+        output.close()
+
+    print(f"{events} events, {sink.count} publishes in {elapsed:.3f}s "
+          f"({events / elapsed if elapsed else 0:.0f} events/s, "
+          f"{sink.count / elapsed if elapsed else 0:.0f} publishes/s)", file=sys.stderr)
+    # publish rates in recorded time
+    for topic, values in publisher.report().items():
+        print(f"{topic}: {values}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a GeckoClient journal without a spa")
+    parser.add_argument("journal", nargs="+",
+                        help="journal file, rotated files are included")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="replay speed factor, 1 = real time, 0 = as fast as possible (default)")
+    parser.add_argument("--output", help="write the published states to this file")
+    parser.add_argument("--quiet", action="store_true",
+                        help="don't write the published states, e.g. for profiling")
+    parser.add_argument("--publish", action="store_true",
+                        help="publish the states on the configured broker")
+    parser.add_argument("--wall-clock", action="store_true",
+                        help="use the current time as timestamp of the payloads")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=config.DEBUG_LEVEL, stream=sys.stderr)
+    logging.getLogger("geckolib").setLevel("WARN")
+
+    asyncio.run(main(args))
@@ -0,0 +1,176 @@
+####
+# systemd notifications (READY, STATUS, WATCHDOG) without external dependencies
+
+import asyncio
+import logging
+import os
+import socket
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Notifier:
+    """
+    Return a notifier.
+
+    Messages are sent to the datagram socket in NOTIFY_SOCKET, which systemd
+    sets for services with Type=notify. Without socket all messages are ignored.
+    """
+
+    def __init__(self, address: str = None):
+        if address is None:
+            address = os.environ.get("NOTIFY_SOCKET")
+        # abstract namespace socket
+        if address and address[0] == "@":
+            address = "\0" + address[1:]
+        self.address = address
+        self._socket = None
+        if address:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    @property
+    def enabled(self) -> bool:
+        return self._socket is not None
+
+    def notify(self, message: str) -> bool:
+        '''
+        Send message, e.g. "READY=1". Returns False if it could not be sent.
+        '''
+        if self._socket is None:
+            return False
+        try:
+            self._socket.sendto(message.encode("UTF-8"), self.address)
+        except OSError as ex:
+            logger.warning(f"Can't notify systemd: {ex}")
+            return False
+        return True
+
+    def ready(self, status: str = None) -> bool:
+        return self.notify("READY=1" + (f"\nSTATUS={status}" if status else ""))
+
+    def status(self, status: str) -> bool:
+        return self.notify(f"STATUS={status}")
+
+    def watchdog(self) -> bool:
+        return self.notify("WATCHDOG=1")
+
+    def stopping(self) -> bool:
+        return self.notify("STOPPING=1")
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def watchdog_interval() -> float:
+    '''
+    Return the watchdog timeout of systemd (WatchdogSec) in seconds,
+    0 if the watchdog is not enabled for this process.
+    '''
+    try:
+        usec = int(os.environ.get("WATCHDOG_USEC", "0"))
+        pid = int(os.environ.get("WATCHDOG_PID", os.getpid()))
+    except ValueError:
+        return 0
+    if pid != os.getpid():
+        return 0
+    return usec / 1000000
+
+
+class Watchdog:
+    """
+    Return a watchdog.
+
+    Notifies systemd once ready() returns True and sends the keep-alive
+    messages as long as the event loop lag stays below max_lag seconds and
+    spa_alive() and broker_alive() returned True within spa_timeout and
+    broker_timeout seconds. The status is updated when it changes.
+    """
+
+    def __init__(self, notifier: Notifier, ready, spa_alive, broker_alive,
+                 max_lag: float = 5, spa_timeout: float = 300, broker_timeout: float = 120,
+                 interval: float = None):
+        self._notifier = notifier
+        self._ready = ready
+        self._spa_alive = spa_alive
+        self._broker_alive = broker_alive
+        self.max_lag = max_lag
+        self.spa_timeout = spa_timeout
+        self.broker_timeout = broker_timeout
+        # keep-alive twice within the timeout of systemd
+        if interval is None:
+            interval = watchdog_interval() / 2
+        self.interval = interval
+
+        self.is_ready = False
+        self.lag = 0.0
+        self._last_spa = time.monotonic()
+        self._last_broker = time.monotonic()
+        self._last_keepalive = None
+        self._status = None
+
+    def check(self) -> str:
+        '''
+        Update the activity and return None if healthy, otherwise the problem.
+        '''
+        now = time.monotonic()
+        if self._spa_alive():
+            self._last_spa = now
+        if self._broker_alive():
+            self._last_broker = now
+
+        if self.lag > self.max_lag:
+            return f"event loop lag above {self.max_lag}s"
+        if now - self._last_spa > self.spa_timeout:
+            return f"no spa connection for {self.spa_timeout}s"
+        if now - self._last_broker > self.broker_timeout:
+            return f"no broker connection for {self.broker_timeout}s"
+        return None
+
+    def _update_status(self, status: str) -> None:
+        if status != self._status:
+            if self.is_ready and status == "Running":
+                logger.info("Health: running")
+            elif self.is_ready:
+                logger.warning(f"Health: {status}")
+            self._status = status
+            self._notifier.status(status)
+
+    def tick(self) -> None:
+        '''
+        Check the health and notify systemd, called about once per second.
+        '''
+        problem = self.check()
+
+        if not self.is_ready:
+            if self._ready():
+                self.is_ready = True
+                self._status = "Running"
+                self._notifier.ready(self._status)
+                logger.info("Notified systemd: ready")
+            else:
+                self._update_status("Waiting for spa")
+            return
+
+        if problem is not None:
+            self._update_status(f"Unhealthy: {problem}")
+            return
+        self._update_status("Running")
+
+        now = time.monotonic()
+        if self.interval and (self._last_keepalive is None or now - self._last_keepalive >= self.interval):
+            self._last_keepalive = now
+            self._notifier.watchdog()
+
+    async def run(self) -> None:
+        '''
+        Measure the event loop lag and call tick every second.
+        '''
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(1)
+            self.lag = max(0.0, time.monotonic() - start - 1)
+            self.tick()
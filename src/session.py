@@ -0,0 +1,96 @@
+####
+# session with the spa, used by the client and by the worker process
+
+from settings import config
+
+import asyncio
+import logging
+
+from geckolib import GeckoConstants, GeckoSpaState
+
+from mySpa import MySpa
+
+
+logger = logging.getLogger(__name__)
+
+# exit codes of a session
+SESSION_OK = 0
+SESSION_NO_FACADE = 1
+SESSION_NO_RECONNECT = 2
+
+
+async def run_session(on_value_change, on_ready, is_stopped, journal=None) -> int:
+    '''
+    Connect to the spa and keep the connection until is_stopped() returns True.
+
+    on_value_change(topic, payload, force) receives the values of the
+    refreshers, force is set if all values were requested. on_ready (async)
+    gets the spa man once the facade is ready. Returns one of the SESSION_*
+    exit codes.
+    '''
+    # get IP of the SPA if set
+    ip = 'DHCP'
+    try:
+        ip = config.SPA_IP_ADDRESS
+    finally:
+        if ip == "DHCP":
+            ip = None
+
+    logger.info("Connecting to SPA...")
+    async with MySpa(config.CLIENT_ID, spa_address=ip, spa_identifier=config.SPA_IDENTIFIER, spa_name=config.SPA_NAME) as spaman:
+
+        await asyncio.sleep(GeckoConstants.ASYNCIO_SLEEP_TIMEOUT_FOR_YIELD)
+
+        # Add the value change callback
+        spaman.onValueChange(on_value_change)
+        if journal is not None:
+            spaman.setJournal(journal)
+
+        # Now wait for the facade to be ready
+        is_facade_ready = await spaman.wait_for_facade()
+        if not is_facade_ready:
+            logger.error(
+                "Stopping - Can't connect to facade. Please check settings.")
+            return SESSION_NO_FACADE
+
+        await on_ready(spaman)
+
+        # get the facade
+        facade = spaman.facade
+
+        # set initial values
+        refresh_counter = 0
+        reconnect_counter = 0
+
+        # Start loop until break signal received
+        while not is_stopped():
+
+            # read on each loop, the configuration can be reloaded
+            broker_int = getattr(config, "BROKER_INTERVAL", 10)
+
+            refresh_counter += 1
+            # check each 10 seconds if mySpa is still connected
+            if (refresh_counter > broker_int):
+
+                refresh_counter = 1
+                if spaman.spa_state is not GeckoSpaState.CONNECTED:
+                    logger.warning("SPA is not connected. Trying to reconnect...")
+                    reconnect_counter += 1
+                    await spaman.async_connect(spa_address=ip, spa_identifier=config.SPA_IDENTIFIER)
+                    if (reconnect_counter > 5):
+                        logger.error(
+                            "Can't reconnect after 5 attempts. Quitting now...")
+                        return SESSION_NO_RECONNECT
+                else:
+                    reconnect_counter = 0
+
+            # write the buffered journal records once per loop
+            if journal is not None:
+                journal.flush()
+
+            await asyncio.sleep(1)
+
+        # final cleanup
+        await facade.disconnect()
+
+    return SESSION_OK
@@ -0,0 +1,117 @@
+####
+# runtime configuration, read from config.py or config.toml and reloadable
+
+import importlib.util
+import logging
+import os
+
+# TOML is part of python from 3.11 on, tomli is needed before
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+
+logger = logging.getLogger(__name__)
+
+# used instead of config.py if it exists next to the modules
+TOML_FILE = "config.toml"
+
+
+def config_file() -> str:
+    '''
+    Get the configuration file: GECKO_CONFIG if set, otherwise config.toml
+    if it exists next to the modules, otherwise config.py.
+    '''
+    path = os.environ.get("GECKO_CONFIG")
+    if path:
+        return path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TOML_FILE)
+    if os.path.exists(path):
+        return path
+    # where "import config" would find it
+    spec = importlib.util.find_spec("config")
+    if spec is None or spec.origin is None:
+        raise ImportError("No config.py or " + TOML_FILE + " found")
+    return spec.origin
+
+
+def read_config(path: str) -> dict:
+    '''
+    Read the upper case values of a config.py or TOML file.
+    '''
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ImportError("Reading " + path + " needs python 3.11 or tomli")
+        with open(path, "rb") as file:
+            values = tomllib.load(file)
+    else:
+        # executed as a fresh module, removed values don't survive a reload
+        spec = importlib.util.spec_from_file_location("config", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        values = vars(module)
+    return {name: value for name, value in values.items() if name.isupper()}
+
+
+class Settings:
+    """
+    Return the settings.
+
+    The values are read like the attributes of the config module, e.g.
+    config.TOPIC or getattr(config, "HTTP_PORT", None). reload reads the file
+    again, the values are kept if it can't be read.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = config_file()
+        self.path = path
+        self._values = read_config(path)
+
+    def __getattr__(self, name: str):
+        try:
+            return self.__dict__["_values"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def reload(self) -> set:
+        '''
+        Read the configuration again and return the names of the changed
+        values, None if it can't be read.
+        '''
+        try:
+            values = read_config(self.path)
+        except Exception as ex:
+            logger.error(f"Can't reload {self.path}, keeping the configuration: {ex!r}")
+            return None
+
+        missing = object()
+        changed = {name for name in self._values.keys() | values.keys()
+                   if self._values.get(name, missing) != values.get(name, missing)}
+        self._values = values
+        logger.info(f"Configuration reloaded from {self.path}")
+        return changed
+
+
+def apply_log_levels() -> None:
+    '''
+    Set DEBUG_LEVEL on the root logger and its handlers and GECKOLIB_DEBUG_LEVEL
+    on the geckolib logger.
+    '''
+    root = logging.getLogger()
+    try:
+        root.setLevel(config.DEBUG_LEVEL)
+        for handler in root.handlers:
+            handler.setLevel(config.DEBUG_LEVEL)
+        logging.getLogger("geckolib").setLevel(
+            getattr(config, "GECKOLIB_DEBUG_LEVEL", "WARN"))
+    except ValueError as ex:
+        logger.error(f"Invalid log level: {ex}")
+
+
+# configuration of the process
+config = Settings()
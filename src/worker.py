@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+"""
+    Worker process running the spa session of GeckoClient.
+
+    The values of the refreshers are streamed to the client as frames on
+    stdout, control messages are received as frames on stdin. Logging goes
+    to stderr and is forwarded by the client into its log file.
+"""
+
+# import python modules
+import locale
+import os
+import sys
+
+import logging
+
+import asyncio
+import functools
+import signal
+import time
+
+# import config
+from settings import config, apply_log_levels
+
+import const
+import ipc
+from journal import configured_journal
+from session import run_session
+
+
+logger = logging.getLogger(__name__)
+
+STATE_STARTING = "STARTING"
+# seconds to wait for the result of a control message
+CONTROL_TIMEOUT = 30
+
+
+class SpaWorker:
+    """
+    Return a spa worker.
+
+    The spa session runs in a separate process (worker.py), the values of the
+    refreshers are passed to publish. The worker is restarted if it exits or
+    doesn't send its status within timeout seconds. The client keeps its
+    broker connection in the meantime.
+    """
+
+    def __init__(self, publish, timeout: float = 30, restart_delay: float = 5):
+        self._publish = publish
+        self.timeout = timeout
+        self.restart_delay = restart_delay
+        self._process = None
+        self._tasks = []
+        # futures of the control messages waiting for their result
+        self._results = {}
+        self._control_id = 0
+
+        # last status reported by the worker
+        self.spa_state = STATE_STARTING
+        self.facade_ready = False
+        self.last_status = None
+        self.restarts = 0
+
+    async def _start(self) -> None:
+        path = os.path.dirname(os.path.abspath(__file__))
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(path, "worker.py"), cwd=path,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        logger.info(f"Worker started with pid {self._process.pid}")
+
+        self.spa_state = STATE_STARTING
+        self.facade_ready = False
+        self.last_status = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._read_frames(self._process.stdout)),
+            asyncio.create_task(self._read_log(self._process.stderr)),
+        ]
+
+    async def _read_frames(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            try:
+                frame = await ipc.read_frame(reader)
+            except Exception as ex:
+                # the following frames can't be found anymore
+                logger.error(
+                    f"Invalid frame received from worker, handling the pipe as broken: {ex!r}")
+                if self._process is not None and self._process.returncode is None:
+                    self._process.kill()
+                return
+            if frame is None:
+                return
+            kind, values = frame
+            try:
+                if kind == ipc.FRAME_PUBLISH:
+                    self._publish(values[0], values[1], values[2])
+                elif kind == ipc.FRAME_STATUS:
+                    self.spa_state, self.facade_ready = values
+                    self.last_status = time.monotonic()
+                elif kind == ipc.FRAME_RESULT:
+                    future = self._results.get(values[0])
+                    if future is not None and not future.done():
+                        future.set_result(values[1])
+                else:
+                    logger.warning(f"Unknown frame {kind} received from worker")
+            except Exception as ex:
+                logger.error(f"Can't handle frame {kind} of worker: {ex!r}")
+
+    async def _read_log(self, reader: asyncio.StreamReader) -> None:
+        # forward the log of the worker, lines are "LEVEL name - message"
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # longer than the limit of the reader, the line is dropped
+                logger.warning("Log line of worker too long, skipped")
+                continue
+            if not line:
+                return
+            line = line.decode("UTF-8", errors="replace").rstrip()
+            level, _, message = line.partition(" ")
+            level = logging.getLevelName(level)
+            if isinstance(level, int):
+                logger.log(level, message)
+            else:
+                logger.debug(line)
+
+    def _send(self, kind: int, *values) -> None:
+        if self._process is None or self._process.returncode is not None:
+            return
+        self._process.stdin.write(ipc.encode_frame(kind, *values))
+
+    async def _stop(self) -> None:
+        if self._process is None:
+            return
+        if self._process.returncode is None:
+            self._send(ipc.FRAME_STOP)
+            try:
+                await asyncio.wait_for(self._process.wait(), 10)
+            except asyncio.TimeoutError:
+                logger.warning("Worker does not stop, killing it")
+                self._process.kill()
+                await self._process.wait()
+        for task in self._tasks:
+            task.cancel()
+        # no results of the running control messages anymore
+        for future in self._results.values():
+            if not future.done():
+                future.set_result(const.CONTROL_FAILED)
+        logger.info(f"Worker stopped with exit code {self._process.returncode}")
+        self._process = None
+
+    def reload(self) -> None:
+        '''
+        Let the worker reload its configuration
+        '''
+        self._send(ipc.FRAME_RELOAD)
+
+    def isConnected(self) -> bool:
+        '''
+        Check if the worker is connected to the spa and reports regularly.
+        '''
+        return self.facade_ready and self.spa_state == "CONNECTED" \
+            and time.monotonic() - self.last_status <= self.timeout
+
+    async def control(self, payload: bytes, topic: str) -> int:
+        '''
+        Pass a control message to the worker and return its CONTROL_* result
+        '''
+        if not self.facade_ready:
+            logger.warning("Spa is not ready, control message dropped")
+            return const.CONTROL_NOT_READY
+        self._control_id += 1
+        control_id = self._control_id
+        future = asyncio.get_running_loop().create_future()
+        self._results[control_id] = future
+        self._send(ipc.FRAME_CONTROL, control_id, topic, payload)
+        try:
+            return await asyncio.wait_for(future, CONTROL_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"No result of control message {control_id} from worker")
+            return const.CONTROL_FAILED
+        finally:
+            self._results.pop(control_id, None)
+
+    async def run(self, is_stopped) -> None:
+        '''
+        Run and supervise the worker until is_stopped() returns True.
+        '''
+        delay = self.restart_delay
+        while not is_stopped():
+            await self._start()
+            started = time.monotonic()
+
+            while not is_stopped():
+                await asyncio.sleep(1)
+                if self._process.returncode is not None:
+                    logger.error(
+                        f"Worker exited with exit code {self._process.returncode}")
+                    break
+                if time.monotonic() - self.last_status > self.timeout:
+                    logger.error(
+                        f"Worker did not report for {self.timeout}s, restarting it")
+                    self._process.kill()
+                    break
+
+            await self._stop()
+            if is_stopped():
+                break
+
+            # back off if the worker fails again shortly after the start
+            if time.monotonic() - started > 10 * self.restart_delay:
+                delay = self.restart_delay
+            else:
+                delay = min(delay * 2, 300)
+            self.restarts += 1
+            logger.warning(f"Restarting worker in {delay}s, restart {self.restarts}")
+            self.facade_ready = False
+            for _ in range(int(delay)):
+                if is_stopped():
+                    break
+                await asyncio.sleep(1)
+
+
+######################
+#
+# Worker process
+#
+##########
+
+async def worker_main() -> int:
+
+    # force decimal separator to point
+    locale._override_localeconv = {'decimal_point': '.'}
+    locale._override_localeconv = {'thousands_sep': ','}
+
+    loop = asyncio.get_running_loop()
+
+    # frames are written to the original stdout, anything printed goes to stderr
+    frame_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    writer, _ = await loop.connect_write_pipe(
+        asyncio.Protocol, os.fdopen(frame_fd, "wb", buffering=0))
+
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    spa = {"spaman": None, "stop": False}
+
+    def send(kind: int, *values) -> None:
+        if not writer.is_closing():
+            writer.write(ipc.encode_frame(kind, *values))
+
+    def on_value_change(topic: str, payload: dict, force: bool) -> None:
+        send(ipc.FRAME_PUBLISH, topic, payload, force)
+
+    async def on_ready(spaman) -> None:
+        spa["spaman"] = spaman
+
+    # running control messages, referenced until done
+    controls = set()
+
+    def control_done(control_id: int, task: asyncio.Task) -> None:
+        controls.discard(task)
+        result = const.CONTROL_FAILED
+        if not task.cancelled():
+            if task.exception() is not None:
+                logger.error(f"Control message failed: {task.exception()!r}")
+            else:
+                result = task.result()
+        send(ipc.FRAME_RESULT, control_id, result)
+
+    async def report_status() -> None:
+        while True:
+            spaman = spa["spaman"]
+            if spaman is None:
+                send(ipc.FRAME_STATUS, STATE_STARTING, False)
+            else:
+                send(ipc.FRAME_STATUS, spaman.spa_state.name, True)
+            await asyncio.sleep(1)
+
+    async def read_commands() -> None:
+        while True:
+            frame = await ipc.read_frame(reader)
+            if frame is None or frame[0] == ipc.FRAME_STOP:
+                # stopped by the client or the client is gone
+                spa["stop"] = True
+                if spa["spaman"] is None:
+                    # still waiting for the spa
+                    session.cancel()
+                return
+            kind, values = frame
+            if kind == ipc.FRAME_CONTROL:
+                control_id, topic, payload = values
+                if spa["spaman"] is None:
+                    send(ipc.FRAME_RESULT, control_id, const.CONTROL_NOT_READY)
+                    continue
+                task = asyncio.create_task(spa["spaman"].control(payload, topic))
+                controls.add(task)
+                task.add_done_callback(functools.partial(control_done, control_id))
+            elif kind == ipc.FRAME_RELOAD:
+                # the client applies the rest
+                changed = config.reload()
+                if changed:
+                    apply_log_levels()
+                    const.set_prefix(config.TOPIC)
+
+    journal = configured_journal()
+    session = asyncio.create_task(run_session(
+        on_value_change, on_ready, lambda: spa["stop"], journal))
+    tasks = [asyncio.create_task(report_status()),
+             asyncio.create_task(read_commands())]
+
+    try:
+        result = await session
+    except asyncio.CancelledError:
+        result = 0
+    if journal is not None:
+        journal.close()
+
+    for task in tasks:
+        task.cancel()
+    writer.close()
+    return result
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(level=config.DEBUG_LEVEL, stream=sys.stderr,
+                        format='%(levelname)s %(name)s - %(message)s')
+    gecko_level = 'WARN'
+    try:
+        gecko_level = config.GECKOLIB_DEBUG_LEVEL
+    finally:
+        logging.getLogger("geckolib").setLevel(gecko_level)
+
+    # the client stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    sys.exit(asyncio.run(worker_main()))